@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+答卷日志离线分析
+流式读取 JSONL 答卷日志（每行 {"answers": {...}} 或直接是答卷），按文件分片多进程处理，
+输出原型分布、A/B/C/D 选择直方图、答题模式频次、分数百分位与吞吐量。
+
+用法: python3 analyze_answer_logs.py logs/*.jsonl [--workers 8] [--chunk-size 50000] [--json report.json]
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from shadow_data import DIMENSION_KEYS
+from shadow_scoring import LABELS, describe_mask, get_model, pattern_masks
+
+# 同步率以 0.1 为精度分桶（0.0 ~ 100.0），百分位可精确求出
+SYNC_BINS = 1001
+SHARD_MIN_BYTES = 16 * 1024 * 1024
+
+
+def plan_shards(paths, workers):
+    """把文件按字节范围切分为分片，大文件切成多片，分片边界在工作进程中对齐到行首"""
+    shards = []
+    for path in paths:
+        size = os.path.getsize(path)
+        pieces = max(1, min(workers, size // SHARD_MIN_BYTES))
+        step = size // pieces + 1
+        shards.extend((path, start, min(start + step, size)) for start in range(0, size, step))
+    return shards
+
+
+def iter_shard_lines(path, start, end):
+    """读取起始位置落在 [start, end) 内的所有行"""
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # 跳到下一个行首（由上一个分片负责这一行）
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                return
+            position += len(line)
+            yield line
+
+
+class Aggregate:
+    """可合并的统计量（均为计数数组，合并即相加）"""
+
+    def __init__(self, model):
+        n_archetypes = len(model.archetypes) + 1  # 最后一位是混沌之影
+        self.rows = 0
+        self.bad_rows = 0
+        self.archetypes = np.zeros(n_archetypes, dtype=np.int64)
+        self.secondary = np.zeros(n_archetypes, dtype=np.int64)
+        self.choices = np.zeros((len(model.questions), model.missing + 1), dtype=np.int64)
+        self.letters = np.zeros(len(LABELS), dtype=np.int64)
+        self.patterns = np.zeros(1 << len(LABELS), dtype=np.int64)
+        self.scores = np.zeros((len(DIMENSION_KEYS), 101), dtype=np.int64)
+        self.sync = np.zeros(SYNC_BINS, dtype=np.int64)
+        self.barrier = 0
+        self.chaos = 0
+
+    def add_chunk(self, model, sheets):
+        codes = model.encode(sheets)
+        result = model.score(codes)
+        n_archetypes = len(self.archetypes)
+        self.rows += len(sheets)
+        self.archetypes += np.bincount(result['primary'] % n_archetypes, minlength=n_archetypes)
+        secondary = result['secondary'][result['secondary'] >= 0]
+        self.secondary += np.bincount(secondary, minlength=n_archetypes)
+        for i in range(codes.shape[1]):
+            self.choices[i] += np.bincount(codes[:, i], minlength=self.choices.shape[1])
+
+        # 由选项下标矩阵向量化统计每份答卷的 A/B/C/D 次数
+        letter_counts = model.letter_counts(codes)
+        self.letters += letter_counts.sum(axis=0)
+        self.patterns += np.bincount(pattern_masks(letter_counts), minlength=len(self.patterns))
+
+        normalized = np.clip(result['normalizedScores'], 0, 100).astype(np.int64)
+        for d in range(len(DIMENSION_KEYS)):
+            self.scores[d] += np.bincount(normalized[:, d], minlength=101)
+        sync_bins = np.clip(np.rint(result['shadowSyncRate'] * 10), 0, SYNC_BINS - 1).astype(np.int64)
+        self.sync += np.bincount(sync_bins, minlength=SYNC_BINS)
+        self.barrier += int(result['isBarrier'].sum())
+        self.chaos += int(result['isChaos'].sum())
+
+    def merge(self, other):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+        return self
+
+
+def process_shard(shard, chunk_size):
+    """工作进程：逐行解析分片，每攒够 chunk_size 份答卷做一次向量化计分"""
+    model = get_model()
+    aggregate = Aggregate(model)
+    sheets = []
+    for line in iter_shard_lines(*shard):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('record must be an object')
+            answers = record.get('answers', record)
+            if not isinstance(answers, dict):
+                raise ValueError('answers must be an object')
+            if not all(isinstance(value, str) for value in answers.values()):
+                raise ValueError('answer values must be strings')
+        except ValueError:
+            aggregate.bad_rows += 1
+            continue
+        sheets.append(answers)
+        if len(sheets) >= chunk_size:
+            aggregate.add_chunk(model, sheets)
+            sheets = []
+    if sheets:
+        aggregate.add_chunk(model, sheets)
+    return aggregate
+
+
+def histogram_percentiles(counts, values, percentiles=(50, 90, 95, 99)):
+    """由计数直方图求百分位"""
+    total = counts.sum()
+    if total == 0:
+        return {f'p{p}': None for p in percentiles}
+    cumulative = np.cumsum(counts)
+    return {
+        f'p{p}': float(values[np.searchsorted(cumulative, total * p / 100)])
+        for p in percentiles
+    }
+
+
+def build_report(model, aggregate, elapsed):
+    """汇总为可输出的报告"""
+    archetype_names = [a['id'] for a in model.archetypes] + [model.chaos['id']]
+    rows = max(aggregate.rows, 1)
+    return {
+        'rows': aggregate.rows,
+        'badRows': aggregate.bad_rows,
+        'seconds': round(elapsed, 3),
+        'rowsPerSecond': round(aggregate.rows / elapsed, 1) if elapsed > 0 else None,
+        'archetypes': {
+            name: {'count': int(count), 'share': round(count / rows, 4)}
+            for name, count in zip(archetype_names, aggregate.archetypes)
+        },
+        'secondaryArchetypes': {
+            name: int(count) for name, count in zip(archetype_names, aggregate.secondary) if count
+        },
+        'isBarrier': aggregate.barrier,
+        'isChaos': aggregate.chaos,
+        'letters': {label: int(count) for label, count in zip(LABELS, aggregate.letters)},
+        'choicesByQuestion': {
+            str(qid): {
+                **{opt['label']: int(row[j]) for j, opt in enumerate(q['options'])},
+                'missing': int(row[model.missing]),
+            }
+            for qid, q, row in zip(model.question_ids, model.questions, aggregate.choices)
+        },
+        'patterns': {
+            describe_mask(mask): int(count) for mask, count in enumerate(aggregate.patterns) if count
+        },
+        'scorePercentiles': {
+            dim: histogram_percentiles(aggregate.scores[d], np.arange(101))
+            for d, dim in enumerate(DIMENSION_KEYS)
+        },
+        'shadowSyncRatePercentiles': histogram_percentiles(aggregate.sync, np.arange(SYNC_BINS) / 10),
+    }
+
+
+def print_report(report):
+    print('=' * 60)
+    print('答卷日志分析')
+    print('=' * 60)
+    print(f"答卷数: {report['rows']}  (无法解析: {report['badRows']})")
+    print(f"耗时:   {report['seconds']}s  ({report['rowsPerSecond']} 行/秒)")
+
+    print('\n原型分布:')
+    for name, item in sorted(report['archetypes'].items(), key=lambda kv: -kv[1]['count']):
+        print(f"  {name:24s} {item['count']:10d}  {item['share'] * 100:5.1f}%")
+    print(f"  阴影屏障: {report['isBarrier']}  混沌态: {report['isChaos']}")
+
+    print('\n选项分布:')
+    print('  ' + '  '.join(f'{label}: {count}' for label, count in report['letters'].items()))
+
+    print('\n答题模式:')
+    for label, count in sorted(report['patterns'].items(), key=lambda kv: -kv[1]):
+        print(f"  {count:10d}  {label.replace(chr(10) + '· ', ' + ')}")
+
+    print('\n分数百分位 (p50 / p90 / p95 / p99):')
+    for dim, pct in report['scorePercentiles'].items():
+        print(f"  {dim:12s} " + ' / '.join(str(v) for v in pct.values()))
+    print('  ' + 'syncRate'.ljust(12) + ' ' + ' / '.join(str(v) for v in report['shadowSyncRatePercentiles'].values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='答卷日志离线分析')
+    parser.add_argument('paths', nargs='+', help='JSONL 日志文件')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='每次向量化计分的答卷数')
+    parser.add_argument('--json', metavar='FILE', help='把完整报告另存为 JSON')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    shards = plan_shards(args.paths, args.workers)
+    model = get_model()
+    total = Aggregate(model)
+    if args.workers <= 1:
+        for shard in shards:
+            total.merge(process_shard(shard, args.chunk_size))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for aggregate in pool.map(process_shard, shards, [args.chunk_size] * len(shards)):
+                total.merge(aggregate)
+    report = build_report(model, total, time.perf_counter() - started)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\n报告已保存: {args.json}')
+
+
+if __name__ == '__main__':
+    main()
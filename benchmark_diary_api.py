@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阴影日记 API 压测
+以固定 RPS（开环）或固定并发（闭环）驱动 /api/generate-diary，统计吞吐量、p50/p95/p99 与错误数，
+结果保存为 JSON，可用 --compare 与上一次的结果对比。
+
+配合假上游使用:
+  python3 fake_upstream.py --port 8045 --latency lognormal --latency-ms 1500
+  DIARY_UPSTREAM_ENDPOINT=http://127.0.0.1:8045 DIARY_RATE_LIMIT=0 python3 shadow-diary-api.py
+  python3 benchmark_diary_api.py --rps 5,10,20 --concurrency 8,32 --duration 20 --vary
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime
+
+import httpx
+
+from shadow_data import load_questions
+
+# 与 test-shadow-diary.py 相同的样例用户：沉默的审判者
+SAMPLE_PAYLOAD = {
+    'shadowSyncRate': 87.3,
+    'primaryArchetype': {'id': 'silent-judge', 'nameCN': '沉默的审判者', 'nameEN': 'The Silent Judge'},
+    'normalizedScores': {
+        'control': 88, 'aggression': 45, 'envy': 38, 'masking': 62, 'destruction': 35, 'detachment': 85,
+    },
+    'answers': {'1': 'B', '2': 'A', '3': 'C', '4': 'D', '5': 'C', '6': 'A', '7': 'A', '8': 'C', '9': 'B'},
+}
+
+
+def payload_factory(base, vary, seed=None):
+    """
+    返回生成请求体的函数
+    vary 时每次随机一份完整答卷（服务端重新计分），用于压测缓存未命中的路径
+    """
+    if not vary:
+        return lambda: base
+    rng = random.Random(seed)
+    questions = load_questions()
+
+    def make():
+        answers = {str(q['id']): rng.choice(q['options'])['label'] for q in questions}
+        return {**base, 'answers': answers}
+    return make
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class LevelStats:
+    """单个压测档位的统计"""
+
+    def __init__(self, mode, level):
+        self.mode = mode
+        self.level = level
+        self.latencies = []
+        self.statuses = Counter()
+        self.sources = Counter()
+        self.errors = Counter()
+        self.started = None
+        self.finished = None
+
+    def record(self, latency, status=None, source=None, error=None):
+        self.latencies.append(latency)
+        if error:
+            self.errors[error] += 1
+            return
+        self.statuses[status] += 1
+        if status != 200:
+            self.errors[f'HTTP {status}'] += 1
+        elif source:
+            self.sources[source] += 1
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        ok = self.statuses.get(200, 0)
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            'mode': self.mode,
+            'level': self.level,
+            'seconds': round(elapsed, 2),
+            'requests': total,
+            'ok': ok,
+            'errors': sum(self.errors.values()),
+            'errorTypes': dict(self.errors),
+            'throughput': round(ok / elapsed, 2) if elapsed > 0 else None,
+            'achievedRps': round(total / elapsed, 2) if elapsed > 0 else None,
+            'latencyMs': {
+                'mean': ms(sum(latencies) / total) if total else None,
+                'p50': ms(percentile(latencies, 50)),
+                'p95': ms(percentile(latencies, 95)),
+                'p99': ms(percentile(latencies, 99)),
+                'max': ms(latencies[-1]) if latencies else None,
+            },
+            'sources': dict(self.sources),
+        }
+
+
+async def send(client, url, payload, stats, started):
+    """发送一次请求；started 为计划发送时刻，开环模式下排队等待也计入延迟"""
+    try:
+        response = await client.post(url, json=payload)
+        source = None
+        if response.status_code == 200:
+            source = response.json().get('source')
+        stats.record(time.perf_counter() - started, response.status_code, source)
+    except httpx.HTTPError as e:
+        stats.record(time.perf_counter() - started, error=type(e).__name__)
+
+
+async def run_open_loop(client, url, make_payload, rps, duration):
+    """开环：按固定间隔发出请求，不等待前一个请求完成"""
+    stats = LevelStats('rps', rps)
+    stats.started = time.perf_counter()
+    interval = 1 / rps
+    tasks = []
+    for i in range(int(rps * duration)):
+        scheduled = stats.started + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(client, url, make_payload(), stats, scheduled)))
+    await asyncio.gather(*tasks)
+    stats.finished = time.perf_counter()
+    return stats
+
+
+async def run_closed_loop(client, url, make_payload, concurrency, duration):
+    """闭环：固定数量的虚拟用户，收到响应后立即发下一个请求"""
+    stats = LevelStats('concurrency', concurrency)
+    stats.started = time.perf_counter()
+    deadline = stats.started + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await send(client, url, make_payload(), stats, time.perf_counter())
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    stats.finished = time.perf_counter()
+    return stats
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_summary(summary):
+    lat = summary['latencyMs']
+    label = f"{summary['mode']}={summary['level']}"
+    print(f"  {label:18s} 请求 {summary['requests']:6d}  成功 {summary['ok']:6d}  错误 {summary['errors']:5d}  "
+          f"吞吐 {summary['throughput']:8.2f}/s  p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms")
+    if summary['errorTypes']:
+        print(f"  {'':18s} 错误类型: {summary['errorTypes']}")
+
+
+def compare_results(current, baseline_path):
+    """与基线结果逐档对比吞吐量与 p95/p99"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['mode'], r['level']): r for r in json.load(f)['results']}
+    print(f'\n对比基线: {baseline_path}')
+    for result in current:
+        base = baseline.get((result['mode'], result['level']))
+        if not base:
+            continue
+        parts = []
+        for name, now, before in [
+            ('吞吐', result['throughput'], base['throughput']),
+            ('p95', result['latencyMs']['p95'], base['latencyMs']['p95']),
+            ('p99', result['latencyMs']['p99'], base['latencyMs']['p99']),
+        ]:
+            if now is not None and before:
+                parts.append(f'{name} {before} → {now} ({(now - before) / before * 100:+.1f}%)')
+        print(f"  {result['mode']}={result['level']}: " + '  '.join(parts))
+
+
+def parse_levels(text):
+    return [float(v) if '.' in v else int(v) for v in text.split(',') if v.strip()] if text else []
+
+
+async def run_benchmark(args):
+    base = SAMPLE_PAYLOAD
+    if args.payload:
+        with open(args.payload, encoding='utf-8') as f:
+            base = json.load(f)
+    make_payload = payload_factory(base, args.vary, args.seed)
+    url = args.url.rstrip('/') + '/api/generate-diary'
+
+    rps_levels = parse_levels(args.rps)
+    concurrency_levels = parse_levels(args.concurrency)
+    if not rps_levels and not concurrency_levels:
+        concurrency_levels = [1, 8]
+    max_inflight = max([int(r * args.timeout) + 1 for r in rps_levels] + concurrency_levels)
+
+    limits = httpx.Limits(max_connections=max_inflight, max_keepalive_connections=max_inflight)
+    results = []
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        if args.warmup > 0:
+            await run_closed_loop(client, url, make_payload, 1, args.warmup)
+        for rps in rps_levels:
+            stats = await run_open_loop(client, url, make_payload, rps, args.duration)
+            results.append(stats.summary())
+            print_summary(results[-1])
+        for concurrency in concurrency_levels:
+            stats = await run_closed_loop(client, url, make_payload, concurrency, args.duration)
+            results.append(stats.summary())
+            print_summary(results[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='阴影日记 API 压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help='API 地址')
+    parser.add_argument('--rps', help='开环档位，逗号分隔，如 5,10,20')
+    parser.add_argument('--concurrency', help='闭环档位，逗号分隔，如 1,8,32（两者都不给时默认 1,8）')
+    parser.add_argument('--duration', type=float, default=20, help='每档持续秒数')
+    parser.add_argument('--warmup', type=float, default=2, help='预热秒数（不计入结果）')
+    parser.add_argument('--timeout', type=float, default=30, help='单请求超时秒数')
+    parser.add_argument('--payload', help='请求体 JSON 文件（默认使用内置样例）')
+    parser.add_argument('--vary', action='store_true', help='每次随机一份答卷，绕开缓存')
+    parser.add_argument('--seed', type=int, help='--vary 的随机种子')
+    parser.add_argument('--output', help='结果 JSON 路径（默认 benchmark-<时间>.json）')
+    parser.add_argument('--compare', metavar='FILE', help='与之前保存的结果对比')
+    parser.add_argument('--label', help='本次压测的备注（写入结果）')
+    args = parser.parse_args()
+
+    print('=' * 60)
+    print(f'压测 {args.url}  每档 {args.duration}s  {"随机答卷" if args.vary else "固定请求体"}')
+    print('=' * 60)
+    started_at = datetime.now()
+    results = asyncio.run(run_benchmark(args))
+
+    report = {
+        'meta': {
+            'label': args.label,
+            'startedAt': started_at.isoformat(timespec='seconds'),
+            'url': args.url,
+            'gitRevision': git_revision(),
+            'duration': args.duration,
+            'vary': args.vary,
+            'timeout': args.timeout,
+        },
+        'results': results,
+    }
+    output = args.output or f"benchmark-{started_at.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'\n结果已保存: {output}')
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,86 +2,555 @@
 """
 将PNG图像批量转换为WebP格式
 大幅减小文件大小，提升网页加载性能
+
+同时输出多种宽度的 WebP/AVIF 响应式变体（文件名带内容哈希）与 srcset 清单，
+移动端只需下载与屏幕相称的尺寸
 """
 
+import argparse
+import hashlib
+import io
+import json
 import os
-from PIL import Image
+import re
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, features
 import glob
 
 # 输入输出目录
 INPUT_DIR = "./src/assets/archetypes"
 OUTPUT_DIR = "./src/assets/archetypes"
 
-def convert_png_to_webp(png_path, quality=85):
+# 转换清单：记录每个PNG的哈希/mtime与编码参数，未变化的文件跳过
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "webp-manifest.json")
+
+# Vite 配置：public 目录下的文件部署在其中 base 指定的子路径下
+VITE_CONFIG_PATH = "./vite.config.ts"
+
+
+def vite_base(config_path=VITE_CONFIG_PATH):
+    """读取 vite.config.ts 中的 base（以 / 结尾），读不到时为 "/"，与 Vite 的默认值一致"""
+    try:
+        with open(config_path, encoding="utf-8") as f:
+            match = re.search(r"""^\s*base\s*:\s*['"`]([^'"`]*)['"`]""", f.read(), re.MULTILINE)
+    except OSError:
+        match = None
+    base = match.group(1) if match else "/"
+    return base if base.endswith("/") else base + "/"
+
+
+# 响应式变体：静态文件目录与对应的URL前缀（带部署子路径），以及供前端构建 srcset 的清单
+VARIANTS_DIR = "./public/archetypes"
+VARIANTS_URL = vite_base() + "archetypes"
+IMAGES_MANIFEST_PATH = "./src/data/archetype-images.json"
+DEFAULT_QUALITY = 85
+DEFAULT_METHOD = 6
+DEFAULT_AVIF_QUALITY = 60
+DEFAULT_WIDTHS = "320,640,960,1280"
+DEFAULT_FORMATS = "avif,webp"  # 顺序即 <picture> 中的优先级
+FORMAT_EXTENSIONS = {"avif": "avif", "webp": "webp"}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def webp_path_for(png_path):
+    return os.path.join(OUTPUT_DIR, os.path.basename(png_path)[:-len(".png")] + ".webp")
+
+
+def is_up_to_date(png_path, entry, settings):
+    """
+    清单记录与当前文件一致时返回 (True, 源哈希)：mtime与大小都没变直接认定，
+    否则再比对内容哈希（只是被 touch 过的文件不会重新编码）；编码参数变化或WebP/变体缺失时需要重新转换
     """
-    将PNG转换为WebP格式
+    webp_path = webp_path_for(png_path)
+    if not entry or entry.get("settings") != settings or not os.path.exists(webp_path):
+        return False, None
+    if os.path.getsize(webp_path) != entry.get("webpSize"):
+        return False, None
+    for variant in entry.get("variants", []):
+        if not os.path.exists(os.path.join(VARIANTS_DIR, variant["file"])):
+            return False, None
+    stat = os.stat(png_path)
+    if stat.st_mtime_ns == entry.get("mtimeNs") and stat.st_size == entry.get("size"):
+        return True, entry["sha256"]
+    source_hash = file_hash(png_path)
+    return source_hash == entry.get("sha256"), source_hash
+
+
+def encode(img, fmt, quality, method):
+    """编码到内存，返回字节（先得到内容哈希才能确定文件名）"""
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        img.save(buffer, "webp", quality=quality, method=method)
+    else:
+        img.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def luma(img):
+    """ITU-R BT.601 亮度（float64数组）"""
+    import numpy as np
+
+    rgb = np.asarray(img.convert("RGB"), dtype=np.float64)
+    return rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+
+
+def psnr(reference, candidate):
+    import numpy as np
+
+    mse = np.mean((reference - candidate) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(reference, candidate, window=8):
+    """亮度通道上 window×window 均值窗口的平均 SSIM（用积分图计算局部统计量）"""
+    import numpy as np
+
+    def box_mean(x):
+        s = np.pad(np.cumsum(np.cumsum(x, 0), 1), ((1, 0), (1, 0)))
+        k = window
+        return (s[k:, k:] - s[:-k, k:] - s[k:, :-k] + s[:-k, :-k]) / (k * k)
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_x, mu_y = box_mean(reference), box_mean(candidate)
+    var_x = box_mean(reference * reference) - mu_x ** 2
+    var_y = box_mean(candidate * candidate) - mu_y ** 2
+    cov = box_mean(reference * candidate) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+METRICS = {"ssim": ssim, "psnr": psnr}
+
+
+def search_quality(img, method, search):
+    """
+    逐图二分搜索 WebP 质量
+
+    search: {targetBytes, metric, target, minQuality, maxQuality}
+      - 只给 targetBytes：不超过字节预算的最高质量
+      - 只给 metric/target：达到目标 SSIM/PSNR 的最低质量
+      - 两者都给：先取达到目标分数的最低质量，超出预算时退回预算内的最高质量
+    预算或目标在搜索范围内无法满足时取范围端点，并在结果中标记 met=False
+
+    Returns:
+        (编码后的字节, {quality, bytes, metric, score, met, trials})
+    """
+    metric = search.get("metric") or "ssim"  # 只按预算搜索时也报告 SSIM
+    reference = luma(img)
+    trials = {}
+
+    def trial(quality):
+        if quality not in trials:
+            data = encode(img, "webp", quality, method)
+            with Image.open(io.BytesIO(data)) as decoded:
+                score = METRICS[metric](reference, luma(decoded))
+            trials[quality] = (data, score)
+        return trials[quality]
+
+    def bisect(predicate, prefer_high):
+        """predicate 随质量单调时，返回满足条件的最高（或最低）质量，没有时返回 None"""
+        low, high, best = search["minQuality"], search["maxQuality"], None
+        while low <= high:
+            mid = (low + high) // 2
+            if predicate(mid):
+                best = mid
+                low, high = (mid + 1, high) if prefer_high else (low, mid - 1)
+            else:
+                low, high = (low, mid - 1) if prefer_high else (mid + 1, high)
+        return best
+
+    budget, target = search.get("targetBytes"), search.get("target")
+    within_budget = (lambda q: len(trial(q)[0]) <= budget) if budget else None
+    quality, met = None, True
+    if target is not None:
+        quality = bisect(lambda q: trial(q)[1] >= target, prefer_high=False)
+        if quality is None:
+            quality, met = search["maxQuality"], False
+    if budget and (quality is None or not within_budget(quality)):
+        fallback = bisect(within_budget, prefer_high=True)
+        met = met and quality is None and fallback is not None
+        quality = fallback if fallback is not None else search["minQuality"]
+
+    data, score = trial(quality)
+    return data, {
+        "quality": quality, "bytes": len(data), "metric": metric,
+        "score": round(score, 4) if score != float("inf") else None, "met": met, "trials": len(trials),
+    }
+
+
+def write_atomic(path, data):
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def ladder(source_width, widths):
+    """不放大：只保留不超过原图宽度的档位，一个都不剩时使用原图宽度"""
+    return sorted({w for w in widths if w <= source_width}) or ([source_width] if widths else [])
+
+
+def write_variants(img, stem, widths, formats, quality, avif_quality, method):
+    """
+    从同一次解码的图像生成各宽度、各格式的变体，写入 VARIANTS_DIR 并删除该原型的旧变体
+
+    Returns:
+        [{format, width, height, bytes, hash, file}, ...]
+    """
+    os.makedirs(VARIANTS_DIR, exist_ok=True)
+    variants = []
+    for width in ladder(img.width, widths):
+        height = round(img.height * width / img.width)
+        resized = img if width == img.width else img.resize((width, height), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            data = encode(resized, fmt, avif_quality if fmt == "avif" else quality, method)
+            digest = hashlib.sha256(data).hexdigest()
+            name = f"{stem}-{width}w.{digest[:10]}.{FORMAT_EXTENSIONS[fmt]}"
+            path = os.path.join(VARIANTS_DIR, name)
+            if not os.path.exists(path):
+                write_atomic(path, data)
+            variants.append({
+                "format": fmt, "width": width, "height": height,
+                "bytes": len(data), "hash": digest, "file": name,
+            })
+
+    keep = {v["file"] for v in variants}
+    pattern = re.compile(rf"^{re.escape(stem)}-\d+w\.[0-9a-f]+\.(?:avif|webp)$")
+    for name in os.listdir(VARIANTS_DIR):
+        if pattern.match(name) and name not in keep:
+            os.remove(os.path.join(VARIANTS_DIR, name))
+    return variants
+
+
+def encode_outputs(img, stem, quality=DEFAULT_QUALITY, method=DEFAULT_METHOD, widths=(), formats=(),
+                   avif_quality=DEFAULT_AVIF_QUALITY, search=None):
+    """
+    从已解码的图像写出全尺寸WebP与响应式变体，返回 (webp_size, 变体列表, 质量搜索结果)
 
     Args:
-        png_path: PNG文件路径
+        img: 已解码的图像
+        stem: 输出文件名（原型id）
         quality: WebP质量 (0-100)，默认85可以保持高质量同时大幅压缩
+        method: 编码器速度/压缩率权衡 (0-6)，6最慢、压缩率最高
+        widths: 响应式变体的宽度档位，为空时不生成变体
+        formats: 变体格式（avif / webp）
+        avif_quality: AVIF质量 (0-100)
+        search: 按字节预算/目标分数逐图搜索质量的参数（见 search_quality），为 None 时使用固定 quality；
+            搜索得到的质量同样用于 WebP 变体
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    # 先写临时文件再替换，中途中断不会留下半个WebP
+    webp_path = webp_path_for(stem + ".png")
+    chosen = None
+    if search:
+        data, chosen = search_quality(img, method, search)
+        quality = chosen["quality"]
+        write_atomic(webp_path, data)
+    else:
+        tmp_path = webp_path + ".part"
+        img.save(tmp_path, "webp", quality=quality, method=method)
+        os.replace(tmp_path, webp_path)
+    variants = write_variants(img, stem, widths, formats, quality, avif_quality, method)
+    return os.path.getsize(webp_path), variants, chosen
+
+
+def convert_png_to_webp(png_path, *options):
+    """
+    将PNG转换为WebP格式，并从同一次解码生成响应式变体（在进程池的子进程中执行，报告由主进程统一输出）
+
+    Args:
+        png_path: PNG文件路径
+        options: quality, method, widths, formats, avif_quality, search（见 encode_outputs）
+
+    Returns:
+        (png_path, webp_size, png_size, 变体列表, 质量搜索结果, 错误信息)，大小单位为字节，失败时大小为0
     """
     try:
-        # 打开PNG图像
-        img = Image.open(png_path)
+        # 打开PNG图像（只解码一次，全尺寸WebP与所有变体共用）
+        with Image.open(png_path) as img:
+            img.load()
+            stem = os.path.basename(png_path)[:-len(".png")]
+            webp_size, variants, chosen = encode_outputs(img, stem, *options)
+        return png_path, webp_size, os.path.getsize(png_path), variants, chosen, None
+
+    except Exception as e:
+        return png_path, 0, 0, [], None, str(e)
 
-        # 生成WebP文件路径
-        webp_path = png_path.replace('.png', '.webp')
 
-        # 转换为WebP
-        img.save(webp_path, 'webp', quality=quality, method=6)
+def convert_image_bytes(data, stem, *options):
+    """
+    生成-编码流水线的入口：直接解码内存中的图像字节（模型返回的原始数据），不经过磁盘上的PNG；
+    data 也可以是已写好的PNG路径（图片URL边下载边写盘的情况）
 
-        # 获取文件大小
-        png_size = os.path.getsize(png_path) / 1024  # KB
-        webp_size = os.path.getsize(webp_path) / 1024  # KB
-        reduction = (1 - webp_size / png_size) * 100  # 压缩率
+    Returns:
+        (webp_size, 变体列表, 质量搜索结果)；失败时抛出异常
+    """
+    with Image.open(io.BytesIO(data) if isinstance(data, bytes) else data) as img:
+        img.load()
+        return encode_outputs(img, stem, *options)
 
-        print(f"✅ {os.path.basename(png_path)}")
-        print(f"   PNG:  {png_size:6.1f} KB")
-        print(f"   WebP: {webp_size:6.1f} KB")
-        print(f"   减小: {reduction:5.1f}%\n")
 
-        return webp_size, png_size
+def parse_widths(text):
+    return sorted({int(w) for w in text.split(",") if w.strip()})
+
+
+def encode_settings(quality=DEFAULT_QUALITY, method=DEFAULT_METHOD, widths=(), formats=(),
+                    avif_quality=DEFAULT_AVIF_QUALITY, search=None):
+    """编码参数（写入清单，变化后对应文件需要重新转换）"""
+    return {
+        "quality": quality, "method": method,
+        "widths": list(widths), "formats": list(formats), "avifQuality": avif_quality, "search": search,
+    }
+
+
+def available_formats(formats):
+    """去掉当前 Pillow 不支持的格式"""
+    if "avif" in formats and not features.check("avif"):
+        print("⚠️  当前 Pillow 不支持 AVIF（需要 Pillow 11.2+ 且带 libavif），只生成其他格式")
+        return [f for f in formats if f != "avif"]
+    return list(formats)
+
+
+def manifest_record(png_path, source_hash, stat, settings, webp_size, variants, chosen):
+    """转换清单中的一条记录；stat 为编码前的源文件状态（编码期间被修改的文件下次会重新转换）"""
+    return {
+        "sha256": source_hash or file_hash(png_path),
+        "mtimeNs": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "settings": settings,
+        "webp": os.path.basename(webp_path_for(png_path)),
+        "webpSize": webp_size,
+        "variants": variants,
+        "qualitySearch": chosen,
+    }
+
+
+def write_images_manifest(manifest):
+    images = build_images_manifest(manifest)
+    os.makedirs(os.path.dirname(IMAGES_MANIFEST_PATH), exist_ok=True)
+    with open(IMAGES_MANIFEST_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(images, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(IMAGES_MANIFEST_PATH + ".tmp", IMAGES_MANIFEST_PATH)
+
+
+def _convert(task):
+    return convert_png_to_webp(*task)
+
+
+def build_images_manifest(manifest):
+    """
+    前端用的 srcset 清单：{原型id: {width, height, sources: {格式: [{width, height, bytes, hash, src}, ...]}}}
+    只包含内容相关的字段，相同输入总是得到相同的文件
+    """
+    images = {}
+    for name, entry in sorted(manifest.items()):
+        variants = entry.get("variants") or []
+        if not variants:
+            continue
+        sources = {}
+        for variant in variants:
+            sources.setdefault(variant["format"], []).append({
+                "width": variant["width"],
+                "height": variant["height"],
+                "bytes": variant["bytes"],
+                "hash": variant["hash"],
+                "src": f"{VARIANTS_URL}/{variant['file']}",
+            })
+        largest = max(variants, key=lambda v: v["width"])
+        images[name[:-len(".png")]] = {"width": largest["width"], "height": largest["height"], "sources": sources}
+    return images
+
+
+def parse_bytes(text):
+    """字节数，可带 K/KB/M/MB 后缀（1024进制）"""
+    value = text.strip().upper().rstrip("B")
+    scale = {"K": 1024, "M": 1024 * 1024}.get(value[-1:], 1)
+    return int(float(value.rstrip("KM")) * scale)
+
+
+def format_search(chosen):
+    score = chosen["score"]
+    score_text = "无损" if score is None else (f"{score:.2f}dB" if chosen["metric"] == "psnr" else f"{score:.4f}")
+    return (f"q={chosen['quality']}  {chosen['metric'].upper()} {score_text}"
+            f"{'' if chosen['met'] else '  (未达到目标)'}  试编码 {chosen['trials']} 次")
+
+
+def print_file_report(png_path, webp_size, png_size, skipped=False, variants=(), chosen=None):
+    png_kb = png_size / 1024
+    webp_kb = webp_size / 1024
+    reduction = (1 - webp_kb / png_kb) * 100 if png_kb else 0.0  # 压缩率
+
+    print(f"{'⏭ ' if skipped else '✅'} {os.path.basename(png_path)}{'（未变化，跳过）' if skipped else ''}")
+    print(f"   PNG:  {png_kb:6.1f} KB")
+    print(f"   WebP: {webp_kb:6.1f} KB")
+    print(f"   减小: {reduction:5.1f}%")
+    if chosen:
+        print(f"   质量: {format_search(chosen)}")
+    for fmt in dict.fromkeys(v["format"] for v in variants):
+        sizes = "  ".join(f"{v['width']}w {v['bytes'] / 1024:.1f}KB" for v in variants if v["format"] == fmt)
+        print(f"   {fmt.upper():5s} {sizes}")
+    print()
 
-    except Exception as e:
-        print(f"❌ 转换失败: {png_path}")
-        print(f"   错误: {str(e)}\n")
-        return 0, 0
 
 def main():
+    parser = argparse.ArgumentParser(description="PNG → WebP 批量转换器")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数（默认CPU核数）")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="WebP质量 (0-100)")
+    parser.add_argument("--method", type=int, default=DEFAULT_METHOD, help="编码器 method (0-6)")
+    parser.add_argument("--widths", default=DEFAULT_WIDTHS, help="响应式变体宽度，逗号分隔（空字符串则不生成变体）")
+    parser.add_argument("--formats", default=DEFAULT_FORMATS, help="变体格式，逗号分隔（avif,webp）")
+    parser.add_argument("--avif-quality", type=int, default=DEFAULT_AVIF_QUALITY, help="AVIF质量 (0-100)")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重新转换")
+    search_group = parser.add_argument_group("逐图质量搜索（任一参数启用，替代固定的 --quality）")
+    search_group.add_argument("--target-bytes", type=parse_bytes, help="全尺寸WebP的字节预算，如 120KB")
+    search_group.add_argument("--target-ssim", type=float, help="目标 SSIM（如 0.98）")
+    search_group.add_argument("--target-psnr", type=float, help="目标 PSNR（dB，如 40）")
+    search_group.add_argument("--min-quality", type=int, default=30, help="搜索下限")
+    search_group.add_argument("--max-quality", type=int, default=95, help="搜索上限")
+    args = parser.parse_args()
+    if args.target_ssim is not None and args.target_psnr is not None:
+        parser.error("--target-ssim 与 --target-psnr 只能选一个")
+    search = None
+    if args.target_bytes or args.target_ssim is not None or args.target_psnr is not None:
+        search = {
+            "targetBytes": args.target_bytes,
+            "metric": "ssim" if args.target_ssim is not None else ("psnr" if args.target_psnr is not None else None),
+            "target": args.target_ssim if args.target_ssim is not None else args.target_psnr,
+            "minQuality": args.min_quality,
+            "maxQuality": args.max_quality,
+        }
+    widths = parse_widths(args.widths)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in FORMAT_EXTENSIONS]
+    if unknown:
+        parser.error(f"不支持的格式: {', '.join(unknown)}")
+    formats = available_formats(formats)
+    settings = encode_settings(args.quality, args.method, widths, formats, args.avif_quality, search)
+
     print("=" * 60)
     print("PNG → WebP 批量转换器")
     print("=" * 60)
 
     # 查找所有PNG文件
-    png_files = glob.glob(os.path.join(INPUT_DIR, "*.png"))
+    png_files = sorted(glob.glob(os.path.join(INPUT_DIR, "*.png")))
 
     if not png_files:
         print("❌ 未找到PNG文件")
         return
 
-    print(f"\n找到 {len(png_files)} 个PNG文件\n")
+    manifest = {} if args.force else load_manifest()
+    pending = []
+    skipped = []
+    source_hashes = {}
+    for png_file in png_files:
+        name = os.path.basename(png_file)
+        up_to_date, source_hash = is_up_to_date(png_file, manifest.get(name), settings)
+        source_hashes[name] = source_hash
+        (skipped if up_to_date else pending).append(png_file)
+
+    print(f"\n找到 {len(png_files)} 个PNG文件，需要转换 {len(pending)} 个，未变化 {len(skipped)} 个\n")
     print("开始转换...\n")
 
     total_webp_size = 0
     total_png_size = 0
     success_count = 0
+    results = {}
+
+    for png_file in skipped:
+        entry = manifest[os.path.basename(png_file)]
+        results[png_file] = (
+            entry["webpSize"], os.path.getsize(png_file), entry.get("variants", []), entry.get("qualitySearch"), None)
+        # 只被 touch 过的文件：更新 mtime，下次不必再算哈希
+        stat = os.stat(png_file)
+        entry.update(mtimeNs=stat.st_mtime_ns, size=stat.st_size)
+
+    if pending:
+        # 转换前记录源文件状态：转换期间被修改的文件下次会重新转换
+        stats = {png_file: os.stat(png_file) for png_file in pending}
+        tasks = [
+            (png_file, args.quality, args.method, widths, formats, args.avif_quality, search) for png_file in pending
+        ]
+        workers = max(1, min(args.workers, len(pending)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for png_file, webp_size, png_size, variants, chosen, error in executor.map(_convert, tasks):
+                results[png_file] = (webp_size, png_size, variants, chosen, error)
+                if error:
+                    continue
+                name = os.path.basename(png_file)
+                manifest[name] = manifest_record(
+                    png_file, source_hashes[name], stats[png_file], settings, webp_size, variants, chosen)
+
+    # 逐个文件报告（按文件名排序，输出与并行度无关）
+    variant_totals = {}
+    searched = []
+    for png_file in png_files:
+        webp_size, png_size, variants, chosen, error = results[png_file]
+        if error:
+            print(f"❌ 转换失败: {png_file}")
+            print(f"   错误: {error}\n")
+            continue
+        print_file_report(png_file, webp_size, png_size, skipped=png_file in skipped, variants=variants, chosen=chosen)
+        if chosen:
+            searched.append((os.path.basename(png_file), chosen))
+        for variant in variants:
+            key = (variant["format"], variant["width"])
+            variant_totals[key] = variant_totals.get(key, 0) + variant["bytes"]
+        success_count += 1
+        total_webp_size += webp_size / 1024
+        total_png_size += png_size / 1024
+
+    # 删除已不存在的PNG的记录
+    names = {os.path.basename(png_file) for png_file in png_files}
+    for name in [name for name in manifest if name not in names]:
+        del manifest[name]
+    save_manifest(manifest)
 
-    for png_file in sorted(png_files):
-        webp_size, png_size = convert_png_to_webp(png_file, quality=85)
-        if webp_size > 0:
-            success_count += 1
-            total_webp_size += webp_size
-            total_png_size += png_size
+    write_images_manifest(manifest)
 
     # 总结报告
     print("=" * 60)
     print("转换完成!")
     print("=" * 60)
-    print(f"成功转换: {success_count}/{len(png_files)}")
+    print(f"成功转换: {success_count}/{len(png_files)}（本次编码 {len(pending)} 个）")
     print(f"\nPNG总大小:  {total_png_size:8.1f} KB ({total_png_size/1024:.2f} MB)")
     print(f"WebP总大小: {total_webp_size:8.1f} KB ({total_webp_size/1024:.2f} MB)")
-    print(f"总共减小:   {(1 - total_webp_size/total_png_size)*100:.1f}%")
+    if total_png_size:
+        print(f"总共减小:   {(1 - total_webp_size/total_png_size)*100:.1f}%")
     print(f"\n节省空间:   {(total_png_size - total_webp_size)/1024:.2f} MB")
+    if searched:
+        print("\n逐图质量搜索:")
+        for name, chosen in searched:
+            print(f"   {name:28s} {chosen['bytes']/1024:7.1f} KB  {format_search(chosen)}")
+    if variant_totals:
+        print("\n响应式变体（全部原型合计）:")
+        for (fmt, width), size in sorted(variant_totals.items()):
+            print(f"   {fmt.upper():5s} {width:5d}w  {size/1024:8.1f} KB")
+        print(f"   srcset 清单: {IMAGES_MANIFEST_PATH}（变体目录 {VARIANTS_DIR}）")
     print(f"\n输出目录:   {OUTPUT_DIR}")
     print("\n提示: 原PNG文件保留作为降级方案")
 
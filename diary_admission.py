@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+准入控制
+上游并发上限 + 有界等待队列，以及按客户端的令牌桶限流；超出时立即拒绝，由调用方返回降级响应
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """超出容量被拒绝；retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    上游并发上限
+
+    同时最多 max_concurrency 个上游调用，其余按先来后到排队；队列已有 max_queue 个等待者，
+    或等待超过 queue_timeout 秒时抛出 Overloaded。只在一个事件循环中使用（与 SingleFlight 相同），
+    多进程部署时每个 worker 各自限制。
+    """
+
+    def __init__(self, max_concurrency=32, max_queue=64, queue_timeout=5.0, service_time=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.service_time = service_time  # 返回单次上游调用的典型耗时（秒），用于估算 Retry-After
+        self.active = 0
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0}
+        self._waiters = deque()
+
+    def retry_after(self):
+        """按排在前面的请求数与典型耗时估算多久后再试（整秒，至少1秒）"""
+        service_time = (self.service_time() if self.service_time else None) or 2.0
+        return max(1, math.ceil(service_time * (len(self._waiters) + 1) / max(self.max_concurrency, 1)))
+
+    async def acquire(self):
+        """占用一个槽位，需要与 release 成对调用（优先使用 slot）"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected['queue_full'] += 1
+            raise Overloaded('Upstream queue is full', self.retry_after(), 'queue_full')
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued_total += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # 超时的同时恰好拿到了槽位：照常使用
+                self.admitted += 1
+                return
+            waiter.cancel()
+            self.rejected['queue_timeout'] += 1
+            raise Overloaded('Timed out waiting for an upstream slot', self.retry_after(), 'queue_timeout')
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        else:
+            self.admitted += 1
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        # 槽位直接交给下一个仍在等待的请求，active 不变
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个上游并发槽位"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': len(self._waiters),
+            'maxConcurrency': self.max_concurrency,
+            'maxQueue': self.max_queue,
+            'queueTimeoutSeconds': self.queue_timeout,
+            'admitted': self.admitted,
+            'queuedTotal': self.queued_total,
+            'rejected': dict(self.rejected),
+        }
+
+
+class ClientRateLimiter:
+    """
+    按客户端的令牌桶限流
+
+    每个客户端每秒补充 rate 个令牌，最多积累 burst 个；rate 为 0 时不限流。
+    最多跟踪 max_clients 个客户端（LRU淘汰），可在多线程中调用。
+    """
+
+    def __init__(self, rate=0, burst=5, max_clients=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets = OrderedDict()  # client -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def acquire(self, client):
+        """消耗一个令牌；成功返回 None，否则返回需要等待的秒数（整秒，至少1秒）"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                wait = None
+            else:
+                self._buckets[client] = (tokens, now)
+                self.limited += 1
+                wait = max(1, math.ceil((1 - tokens) / self.rate))
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._buckets)
+        return {'rate': self.rate, 'burst': self.burst, 'clients': clients, 'limited': self.limited}
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量日记生成
+从 JSON 数组或 JSONL 流中逐条读取请求体，以有界并发处理，按完成顺序输出 NDJSON
+"""
+
+import asyncio
+import json
+
+
+async def iter_batch_items(chunks):
+    """
+    把请求体字节块解析为逐条的请求
+
+    以 '[' 开头视为 JSON 数组（整体解析，无法解析时整体作为一条）；否则按行读取 JSONL，读一行交出一行。
+    产出原始行（bytes）或已解析的对象，解析错误留给单条处理时报告。
+    """
+    buffer = b''
+    first = True
+    async for chunk in chunks:
+        buffer += chunk
+        if first:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            first = False
+            if stripped.startswith(b'['):
+                async for more in chunks:
+                    buffer += more
+                try:
+                    items = json.loads(buffer)
+                except ValueError:
+                    # 数组整体无法解析：原样交出，由单条处理报告为一条 400 错误
+                    yield buffer
+                    return
+                for item in items:
+                    yield item
+                return
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def iter_bytes(data, chunk_size=65536):
+    """把内存中的 bytes 切成异步字节块"""
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+async def iter_file(f, chunk_size=65536):
+    """把二进制文件对象读成异步字节块（CLI 使用）"""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def run_batch(items, handle, concurrency=8):
+    """
+    有界并发批处理
+
+    同时最多 concurrency 条在处理中，槽位空出后才读取下一条，输入与结果都不需要整体留在内存。
+    handle(请求体) 返回 (响应体, 状态码)；单条异常只影响该条。按完成顺序产出 NDJSON 行（str），
+    每行带 index、status（降级的预制解读为 503）与请求中的 id（clientId）。
+    """
+    async def process(index, item):
+        try:
+            if isinstance(item, (bytes, str)):
+                item = json.loads(item)
+            payload, status = await handle(item)
+        except Exception as e:
+            payload, status = {'success': False, 'error': f'{type(e).__name__}: {e}', 'diary': ''}, 400
+        if status == 200 and payload.get('source') == 'fallback':
+            # 熔断/过载时的预制解读：仍带日记，但用 503 与 degraded 标记，批量调用方可以稍后重跑这些条目
+            status = 503
+            payload = {**payload, 'degraded': True}
+        line = {'index': index, 'status': status, **payload}
+        # 请求中的 id 是调用方的关联id，原样放在 clientId；响应体中的 id 是可分享的结果id
+        if isinstance(item, dict) and 'id' in item:
+            line['clientId'] = item['id']
+        return json.dumps(line, ensure_ascii=False) + '\n'
+
+    pending = set()
+    index = 0
+    async for item in items:
+        if len(pending) >= concurrency:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+        pending.add(asyncio.ensure_future(process(index, item)))
+        index += 1
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
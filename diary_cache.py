@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阴影日记缓存
+按 (原型, 分桶后的六维分数, 答题模式) 缓存生成结果，内存LRU + 可选SQLite持久层（由后台线程批量写入）
+"""
+
+import atexit
+import hashlib
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DIMENSION_KEYS = ['control', 'aggression', 'envy', 'masking', 'destruction', 'detachment']
+
+
+def quantize_scores(scores, bucket_size=10):
+    """将六维分数量化到分桶，返回元组"""
+    bucket_size = max(1, int(bucket_size))
+    return tuple(int(float(scores.get(dim, 0)) // bucket_size) for dim in DIMENSION_KEYS)
+
+
+def make_cache_key(archetype, scores, patterns, bucket_size=10):
+    """构建缓存键：原型id + 分桶分数 + 答题模式"""
+    archetype_id = archetype.get('id') or archetype.get('nameEN', '')
+    buckets = '-'.join(str(b) for b in quantize_scores(scores, bucket_size))
+    pattern_hash = hashlib.sha1(patterns.encode('utf-8')).hexdigest()[:12]
+    return f'{archetype_id}:{buckets}:{pattern_hash}'
+
+
+class DiaryCache:
+    """
+    日记变体缓存
+
+    每个键保存最多 variants 条日记。变体未攒满前视为未命中，
+    由调用方继续生成并 put；攒满后随机返回一条，跳过上游调用。
+
+    Args:
+        max_entries: 内存中最多保留的键数量（LRU淘汰）
+        ttl: 条目有效期（秒），0 表示永不过期
+        variants: 每个键保留的日记变体数
+        db_path: SQLite 文件路径，为空则只使用内存
+    """
+
+    def __init__(self, max_entries=2048, ttl=7 * 24 * 3600, variants=3, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self._entries = OrderedDict()  # key -> (created_at, [diary, ...])
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self._db = None
+        self._writes = queue.SimpleQueue()  # 待写入SQLite的 (key, diary, created_at)
+        self._writer = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS diary_cache ('
+                'key TEXT NOT NULL, diary TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS idx_diary_cache_key ON diary_cache (key)')
+            self._db.commit()
+            atexit.register(self.flush)
+
+    def reopen(self):
+        """fork 之后在子进程中重新连接 SQLite（连接不能跨进程共享），写线程在子进程中按需重建"""
+        if self._db_path:
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._writes = queue.SimpleQueue()
+            self._writer = None
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._writes.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def _insert(self, db, rows):
+        if rows:
+            db.executemany('INSERT INTO diary_cache (key, diary, created_at) VALUES (?, ?, ?)', rows)
+            db.commit()
+
+    def _write_loop(self):
+        db = sqlite3.connect(self._db_path)
+        while True:
+            rows = [self._writes.get()]
+            rows += self._drain()
+            try:
+                self._insert(db, rows)
+            except sqlite3.Error as e:
+                print(f'Error writing diary cache: {e}')
+
+    def flush(self):
+        """把尚未写入的变体立即写入（进程退出时调用）"""
+        if self._db_path:
+            self._insert(sqlite3.connect(self._db_path), self._drain())
+
+    def _expired(self, created_at, now):
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _load_from_db(self, key, now):
+        """从SQLite读取未过期的变体"""
+        rows = self._db.execute(
+            'SELECT diary, created_at FROM diary_cache WHERE key = ? ORDER BY created_at',
+            (key,)
+        ).fetchall()
+        rows = [(d, c) for d, c in rows if not self._expired(c, now)][:self.variants]
+        if not rows:
+            return None
+        return rows[0][1], [d for d, _ in rows]
+
+    def get(self, key):
+        """返回一条缓存日记；变体未攒满或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0], now):
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                entry = self._load_from_db(key, now)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            diaries = entry[1]
+            if len(diaries) < self.variants:
+                return None
+            return random.choice(diaries)
+
+    def put(self, key, diary):
+        """追加一条日记变体"""
+        if not diary:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[0], now):
+                entry = (now, [])
+            diaries = entry[1]
+            if len(diaries) >= self.variants:
+                return
+            diaries.append(diary)
+            self._store(key, entry)
+            if self._db is not None:
+                # 落盘交给写线程，调用方（事件循环）不等待磁盘 I/O
+                if self._writer is None or not self._writer.is_alive():
+                    self._writer = threading.Thread(target=self._write_loop, name='diary-cache-writer', daemon=True)
+                    self._writer.start()
+                self._writes.put((key, diary, now))
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """缓存统计"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'variants': self.variants,
+                'ttl': self.ttl,
+                'persistent': self._db is not None,
+            }
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型调用录制/回放
+以 httpx transport 的形式录下与代理的真实往返（generateContent / streamGenerateContent /
+chat.completions），保存为 JSONL 卡带（.gz 结尾时压缩），回放时按原始（或缩放后的）时间逐块返回，
+让日记脚本、API 与图片生成器可以离线、可重复地运行和压测。
+
+进程内使用：API 设置 DIARY_CASSETTE / DIARY_CASSETTE_MODE，图片生成器设置 IMAGE_API_CASSETTE / IMAGE_API_CASSETTE_MODE。
+其他客户端（如 test-shadow-diary.py 的 google-generativeai）通过卡带服务器使用:
+  python3 diary_cassette.py --cassette prod.jsonl.gz --mode record --upstream http://127.0.0.1:8045 --port 8050
+  python3 diary_cassette.py --cassette prod.jsonl.gz --mode replay --port 8050 --time-scale 0.5
+卡带只保存请求的哈希与响应，不保存请求头（API Key 不会落盘）。
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+import httpx
+
+MODES = ('record', 'replay')
+# 回放时保留的响应头：其余（长度、日期、连接等）由 httpx 重新生成
+KEPT_HEADERS = ('content-type', 'content-encoding', 'retry-after')
+# 录制时间隔小于该值的相邻分块合并为一块，卡带更紧凑
+MERGE_CHUNKS_MS = 5.0
+
+
+def request_route(request):
+    """方法 + 路径（含查询串），不含主机：回放与端点无关"""
+    return f'{request.method} {request.url.raw_path.decode("ascii")}'
+
+
+def request_key(request):
+    """请求的内容哈希：JSON 请求体按键排序后参与计算，字段顺序不同的相同请求得到相同的键"""
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode('utf-8')
+    except ValueError:
+        pass
+    return hashlib.sha256(request_route(request).encode('utf-8') + b'\n' + body).hexdigest()[:20]
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class Cassette:
+    """
+    卡带
+
+    Args:
+        path: 卡带文件（JSONL，.gz 结尾时 gzip 压缩；录制时追加）
+        mode: record 或 replay
+        time_scale: 回放时间倍率（1 为原始时间，0.5 快一倍，0 不等待）
+        match: exact（只按请求哈希匹配）或 route（没有完全相同的请求时退回同一路由的录音，
+            用于以不同的提示词复现录制时的延迟分布）
+    """
+
+    def __init__(self, path, mode, time_scale=1.0, match='route'):
+        if mode not in MODES:
+            raise ValueError(f'Unknown cassette mode: {mode}')
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.match = match
+        self.recorded = 0
+        self.replayed = {'exact': 0, 'route': 0, 'missing': 0}
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_route = {}
+        if mode == 'replay':
+            self._load()
+
+    def _load(self):
+        by_key, by_route = {}, {}
+        with _open(self.path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    by_key.setdefault(entry['key'], []).append(entry)
+                    by_route.setdefault(entry['route'], []).append(entry)
+        # 同一请求录了多次时轮流回放，保留录制时的延迟分布
+        self._by_key = {key: itertools.cycle(entries) for key, entries in by_key.items()}
+        self._by_route = {route: itertools.cycle(entries) for route, entries in by_route.items()}
+        self.entries = sum(len(entries) for entries in by_key.values())
+
+    def find(self, request):
+        with self._lock:
+            entries = self._by_key.get(request_key(request))
+            kind = 'exact'
+            if entries is None and self.match == 'route':
+                entries, kind = self._by_route.get(request_route(request)), 'route'
+            if entries is None:
+                self.replayed['missing'] += 1
+                return None
+            self.replayed[kind] += 1
+            return next(entries)
+
+    def append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # gzip 追加写入会产生多个成员，读取时自动拼接
+            with _open(self.path, 'a') as f:
+                f.write(line + '\n')
+            self.recorded += 1
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path, 'mode': self.mode, 'timeScale': self.time_scale,
+                    'recorded': self.recorded, 'replayed': dict(self.replayed)}
+
+
+def _merge_chunks(chunks):
+    """[(毫秒, 字节)] → (正文, [[毫秒, 结束偏移], ...])，间隔很小的相邻分块合并"""
+    body = bytearray()
+    marks = []
+    for ms, chunk in chunks:
+        body += chunk
+        if marks and ms - marks[-1][0] < MERGE_CHUNKS_MS:
+            marks[-1] = [round(ms, 1), len(body)]
+        else:
+            marks.append([round(ms, 1), len(body)])
+    return bytes(body), marks
+
+
+def build_entry(request, response, headers_ms, chunks, complete):
+    body, marks = _merge_chunks(chunks)
+    entry = {
+        'key': request_key(request),
+        'route': request_route(request),
+        'status': response.status_code,
+        'headers': {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS},
+        'headersMs': round(headers_ms, 1),
+        'chunks': marks,
+        'complete': complete,
+        'recordedAt': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    try:
+        entry['text'] = body.decode('utf-8')
+    except UnicodeDecodeError:
+        entry['b64'] = base64.b64encode(body).decode('ascii')
+    return entry
+
+
+class _RecordingStream:
+    """包装上游响应流，记录每个分块的到达时间；关闭时写入卡带（提前关闭的流记为不完整）"""
+
+    def __init__(self, stream, on_close, started):
+        self._stream = stream
+        self._on_close = on_close
+        self._started = started
+        self._chunks = []
+        self._complete = False
+
+    def _record(self, chunk):
+        self._chunks.append(((time.perf_counter() - self._started) * 1000, chunk))
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+        self._complete = True
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+        self._complete = True
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._on_close(self._chunks, self._complete)
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close(self._chunks, self._complete)
+
+
+class _ReplayStream:
+    """按录制时的到达时间（乘以 time_scale）逐块返回正文"""
+
+    def __init__(self, body, marks, started, time_scale):
+        self._body = body
+        self._marks = marks
+        self._started = started
+        self._time_scale = time_scale
+
+    def _delays(self):
+        start = 0
+        for ms, end in self._marks:
+            delay = ms * self._time_scale / 1000 - (time.perf_counter() - self._started)
+            yield max(0.0, delay), self._body[start:end]
+            start = end
+
+    def __iter__(self):
+        for delay, chunk in self._delays():
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+    async def __aiter__(self):
+        for delay, chunk in self._delays():
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+@functools.lru_cache(maxsize=None)
+def _stream_class(http, mixin):
+    """把流 mixin 与客户端所用 httpx 模块的流基类组合（httpx 按基类区分同步/异步流）"""
+    return type(mixin.__name__, (mixin, http.SyncByteStream, http.AsyncByteStream), {})
+
+
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    录制/回放 transport，同步（openai SDK）与异步（diary_upstream）客户端通用
+
+    record 模式下请求交给 inner（真实的 httpx transport）并录下响应；replay 模式不发出任何网络请求，
+    卡带中没有对应录音时返回 404（错误信息注明未录制）。
+    http 为客户端所用的 httpx 模块（openai SDK 可能自带一份，响应与流须用同一模块的类型）
+    """
+
+    def __init__(self, cassette, inner=None, http=httpx):
+        self.cassette = cassette
+        self.inner = inner
+        self.http = http
+
+    def _missing(self, request):
+        return self.http.Response(404, json={'error': {'message': f'Not in cassette: {request_route(request)}'}},
+                              request=request)
+
+    def _replay_response(self, request, entry, started):
+        body = entry['text'].encode('utf-8') if 'text' in entry else base64.b64decode(entry['b64'])
+        stream = _stream_class(self.http, _ReplayStream)(body, entry['chunks'], started, self.cassette.time_scale)
+        return self.http.Response(entry['status'], headers=entry['headers'], stream=stream, request=request)
+
+    def _recording_response(self, request, response, started):
+        headers_ms = (time.perf_counter() - started) * 1000
+
+        def on_close(chunks, complete):
+            self.cassette.append(build_entry(request, response, headers_ms, chunks, complete))
+
+        response.stream = _stream_class(self.http, _RecordingStream)(response.stream, on_close, started)
+        return response
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.find(request)
+            if entry is None:
+                return self._missing(request)
+            delay = entry['headersMs'] * self.cassette.time_scale / 1000
+            if delay:
+                time.sleep(delay)
+            return self._replay_response(request, entry, started)
+        request.read()
+        return self._recording_response(request, self.inner.handle_request(request), started)
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        if self.cassette.mode == 'replay':
+            entry = self.cassette.find(request)
+            if entry is None:
+                return self._missing(request)
+            delay = entry['headersMs'] * self.cassette.time_scale / 1000
+            if delay:
+                await asyncio.sleep(delay)
+            return self._replay_response(request, entry, started)
+        await request.aread()
+        return self._recording_response(request, await self.inner.handle_async_request(request), started)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+    async def aclose(self):
+        if self.inner is not None:
+            await self.inner.aclose()
+
+
+def cassette_from_env(prefix):
+    """读取 {prefix}_CASSETTE、_CASSETTE_MODE（默认 replay）、_CASSETTE_TIME_SCALE、_CASSETTE_MATCH，未设置时返回 None"""
+    path = os.environ.get(f'{prefix}_CASSETTE')
+    if not path:
+        return None
+    return Cassette(
+        path,
+        os.environ.get(f'{prefix}_CASSETTE_MODE', 'replay'),
+        time_scale=float(os.environ.get(f'{prefix}_CASSETTE_TIME_SCALE', '1.0')),
+        match=os.environ.get(f'{prefix}_CASSETTE_MATCH', 'route'),
+    )
+
+
+def summarize(path):
+    """卡带中各路由的录音数与延迟分布（首包 / 完成，毫秒）"""
+    routes = {}
+    with _open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                total = entry['chunks'][-1][0] if entry['chunks'] else entry['headersMs']
+                routes.setdefault(entry['route'], []).append((entry['headersMs'], total, entry['status']))
+    summary = {}
+    for route, samples in sorted(routes.items()):
+        totals = sorted(s[1] for s in samples)
+        summary[route] = {
+            'count': len(samples),
+            'errors': sum(1 for s in samples if s[2] >= 400),
+            'headersMsP50': sorted(s[0] for s in samples)[len(samples) // 2],
+            'totalMsP50': totals[len(totals) // 2],
+            'totalMsP95': totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+        }
+    return summary
+
+
+def create_app(cassette, upstream):
+    """卡带服务器：把任意客户端的请求转给录制/回放 transport（record 模式再转发到 upstream）"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    inner = httpx.AsyncHTTPTransport() if cassette.mode == 'record' else None
+    client = httpx.AsyncClient(transport=CassetteTransport(cassette, inner), base_url=upstream or 'http://cassette',
+                               timeout=httpx.Timeout(300.0, connect=10.0))
+    # 只转发与内容有关的请求头（录制时 API Key 会发给上游，但不会写入卡带）
+    forwarded = ('content-type', 'authorization', 'x-goog-api-key', 'accept')
+
+    async def proxy(request):
+        body = await request.body()
+        headers = {k: v for k, v in request.headers.items() if k.lower() in forwarded}
+        # 原样转发路径与查询串，卡带中的路由与客户端直连上游时一致
+        target = request.scope['raw_path'].decode('ascii')
+        if request.scope['query_string']:
+            target += '?' + request.scope['query_string'].decode('ascii')
+        upstream_request = client.build_request(request.method, target, content=body, headers=headers)
+        response = await client.send(upstream_request, stream=True)
+        return StreamingResponse(
+            response.aiter_raw(), status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS},
+            background=_CloseTask(response))
+
+    async def stats(request):
+        return JSONResponse(cassette.stats())
+
+    return Starlette(routes=[
+        Route('/_cassette', stats),
+        Route('/{path:path}', proxy, methods=['GET', 'POST', 'PUT', 'DELETE']),
+    ])
+
+
+class _CloseTask:
+    """响应发送完后关闭上游响应（录制模式下此时写入卡带）"""
+
+    def __init__(self, response):
+        self.response = response
+
+    async def __call__(self):
+        await self.response.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模型调用录制/回放服务器')
+    parser.add_argument('--cassette', required=True, help='卡带文件（.jsonl 或 .jsonl.gz）')
+    parser.add_argument('--mode', choices=MODES, default='replay')
+    parser.add_argument('--upstream', default='http://127.0.0.1:8045', help='录制时转发的目标')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--time-scale', type=float, default=1.0, help='回放时间倍率（0 表示不等待）')
+    parser.add_argument('--match', choices=('exact', 'route'), default='route')
+    parser.add_argument('--summary', action='store_true', help='只打印卡带的延迟摘要')
+    args = parser.parse_args()
+
+    if args.summary:
+        print(json.dumps(summarize(args.cassette), ensure_ascii=False, indent=2))
+        return
+
+    import uvicorn
+
+    cassette = Cassette(args.cassette, args.mode, time_scale=args.time_scale, match=args.match)
+    loaded = f'，已载入 {cassette.entries} 条录音' if args.mode == 'replay' else f'，转发到 {args.upstream}'
+    print(f'卡带服务器 ({args.mode}) 监听 http://127.0.0.1:{args.port}{loaded}')
+    uvicorn.run(create_app(cassette, args.upstream), host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游端点池
+多个代理端点之间按 EWMA 延迟 / 进行中请求数选择，连续失败的端点被摘除，冷却或主动健康检查通过后重新加入。
+线程安全：API 的事件循环与图片生成脚本的线程池都可以直接使用。
+"""
+
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+STRATEGIES = ('least_latency', 'least_inflight')
+
+
+def parse_endpoints(value, default):
+    """逗号分隔的端点列表（去掉末尾的 /），为空时返回 [default]"""
+    endpoints = [url.strip().rstrip('/') for url in (value or '').split(',') if url.strip()]
+    return endpoints or [default.rstrip('/')]
+
+
+class Endpoint:
+    """单个上游端点的状态"""
+
+    def __init__(self, url):
+        self.url = url
+        self.ewma_ms = None
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+
+class EndpointPool:
+    """
+    端点池
+
+    Args:
+        urls: 端点地址列表
+        strategy: least_latency（EWMA × (进行中+1)，未测量过的端点优先试探）或 least_inflight
+        alpha: EWMA 平滑系数
+        eject_after: 连续失败多少次后摘除
+        eject_seconds: 首次摘除时长，之后每次翻倍，最多 max_eject_seconds
+    """
+
+    def __init__(self, urls, strategy='least_latency', alpha=0.3, eject_after=3, eject_seconds=30,
+                 max_eject_seconds=300):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown endpoint strategy: {strategy}')
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.strategy = strategy
+        self.alpha = alpha
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def _score(self, endpoint):
+        ewma = endpoint.ewma_ms or 0.0
+        if self.strategy == 'least_inflight':
+            return (endpoint.inflight, ewma)
+        return (ewma * (endpoint.inflight + 1), endpoint.inflight)
+
+    def choose(self, exclude=()):
+        """选择一个端点；全部被摘除时选最早恢复的一个（宁可试探也不完全停摆）"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.url not in exclude] or self.endpoints
+            available = [e for e in candidates if not e.is_ejected(now)]
+            if not available:
+                return min(candidates, key=lambda e: e.ejected_until)
+            best = min(self._score(e) for e in available)
+            return random.choice([e for e in available if self._score(e) == best])
+
+    @contextmanager
+    def track(self, endpoint, is_failure=None):
+        """
+        记录一次请求：进行中计数，成功时更新 EWMA 延迟，异常时计为失败
+        is_failure(异常) 可排除与端点无关的错误；取消（如对冲中被放弃的一方）不计入。
+        在异步生成器中使用时，调用方提前关闭（GeneratorExit）说明端点已正常产出，按成功记录
+        """
+        with self._lock:
+            endpoint.inflight += 1
+            endpoint.requests += 1
+        started = time.perf_counter()
+        outcome = None
+        try:
+            yield
+            outcome = True
+        except GeneratorExit:
+            outcome = True
+            raise
+        except Exception as e:
+            outcome = False if is_failure is None or is_failure(e) else None
+            raise
+        finally:
+            with self._lock:
+                endpoint.inflight -= 1
+            if outcome:
+                self.record_success(endpoint, (time.perf_counter() - started) * 1000)
+            elif outcome is False:
+                self.record_failure(endpoint)
+
+    def record_success(self, endpoint, latency_ms=None):
+        with self._lock:
+            if latency_ms is not None:
+                if endpoint.ewma_ms is None:
+                    endpoint.ewma_ms = latency_ms
+                else:
+                    endpoint.ewma_ms = self.alpha * latency_ms + (1 - self.alpha) * endpoint.ewma_ms
+            endpoint.consecutive_failures = 0
+            endpoint.ejections = 0
+            endpoint.ejected_until = 0.0
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            now = time.monotonic()
+            if endpoint.is_ejected(now):
+                # 摘除前已发出的请求陆续失败，不再延长摘除时间
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.eject_after:
+                duration = min(self.eject_seconds * 2 ** endpoint.ejections, self.max_eject_seconds)
+                endpoint.ejected_until = now + duration
+                endpoint.ejections += 1
+                # 恢复后再失败一次就重新摘除
+                endpoint.consecutive_failures = self.eject_after - 1
+
+    def record_probe(self, endpoint, healthy):
+        """
+        主动健康检查结果：被摘除的端点探测成功则提前恢复（再失败一次即重新摘除），
+        探测失败计入连续失败；探测成功不抵消真实请求的失败
+        """
+        if not healthy:
+            self.record_failure(endpoint)
+            return
+        with self._lock:
+            if endpoint.is_ejected(time.monotonic()):
+                endpoint.ejected_until = 0.0
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'url': e.url,
+                    'ewmaMs': round(e.ewma_ms, 1) if e.ewma_ms is not None else None,
+                    'inflight': e.inflight,
+                    'requests': e.requests,
+                    'failures': e.failures,
+                    'ejected': e.is_ejected(now),
+                    'ejectedForSeconds': round(max(0.0, e.ejected_until - now), 1),
+                }
+                for e in self.endpoints
+            ]
+
+
+async def health_check_loop(pool, probe, interval=10.0):
+    """异步主动健康检查：每 interval 秒并发探测所有端点，probe(url) 返回是否健康"""
+    async def check(endpoint):
+        try:
+            healthy = await probe(endpoint.url)
+        except Exception:
+            healthy = False
+        pool.record_probe(endpoint, healthy)
+
+    while True:
+        await asyncio.gather(*(check(e) for e in pool.endpoints))
+        await asyncio.sleep(interval)
+
+
+def start_health_thread(pool, probe, interval=10.0):
+    """同步版本：在守护线程中定期探测（供图片生成等同步脚本使用）"""
+    def run():
+        while True:
+            for endpoint in pool.endpoints:
+                try:
+                    healthy = probe(endpoint.url)
+                except Exception:
+                    healthy = False
+                pool.record_probe(endpoint, healthy)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='endpoint-health', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日记字数控制
+流式生成时一旦在目标字数区间内写完一个完整句子就停止上游；生成结果再经过一次校验，
+超长的截到区间内最后一个完整句子，截不出合格结果的才需要重新生成
+"""
+
+# 句末标点，以及可以紧跟在句末标点之后的收尾符号（引号、括号、省略号的后半）
+SENTENCE_ENDS = '。！？!?…'
+CLOSERS = '”’」』）)"\'…'
+
+
+def count_chars(text):
+    """日记字数：不计空白的字符数（标点计入，与提示词中的“字数”一致）"""
+    return sum(1 for ch in text if not ch.isspace())
+
+
+def cut_at_sentence(text, max_chars):
+    """截到字数不超过 max_chars 的最后一个完整句子，返回 (文本, 字数)；没有完整句子时返回 ('', 0)"""
+    best, best_count, count = 0, 0, 0
+    in_end = False
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            in_end = False
+            continue
+        count += 1
+        if count > max_chars:
+            break
+        in_end = ch in SENTENCE_ENDS or (in_end and ch in CLOSERS)
+        if in_end:
+            best, best_count = i + 1, count
+    return text[:best].strip(), best_count
+
+
+def fit_to_window(text, min_chars, max_chars):
+    """
+    校验日记字数，返回 (文本, 是否符合要求)
+
+    在区间内且以完整句子结尾的原样返回；超长或结尾不完整的截到区间内最后一个完整句子；
+    截完不足 min_chars（或本来就太短）时标记为不符合，超长的仍返回截断结果，其余返回原文
+    """
+    text = text.strip()
+    trimmed, trimmed_count = cut_at_sentence(text, max_chars)
+    if trimmed_count >= min_chars:
+        return trimmed, True
+    if trimmed and count_chars(text) > max_chars:
+        return trimmed, False
+    return text, False
+
+
+def _quotes_open(text):
+    return text.count('“') > text.count('”') or text.count('「') > text.count('」')
+
+
+class LengthGuard:
+    """
+    流式字数守卫
+
+    逐块 feed 上游输出，返回可以输出的部分。字数达到 min_chars 后第一个句子结束时停止（early_stop），
+    超过 max_chars 仍没有句子结束时也停止（overlong，由 fit_to_window 截断或重新生成）
+    """
+
+    def __init__(self, min_chars, max_chars):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.text = ''
+        self.count = 0
+        self.stopped = None  # None / 'early_stop' / 'overlong'
+        self._pending_end = False
+
+    def feed(self, chunk):
+        if self.stopped:
+            return ''
+        accepted = None
+        for i, ch in enumerate(chunk):
+            if self._pending_end:
+                # 区间内的句末标点之后：吞下紧跟的收尾符号后停止
+                if ch in CLOSERS:
+                    self.count += 1
+                    continue
+                accepted, self.stopped = chunk[:i], 'early_stop'
+                break
+            if ch.isspace():
+                continue
+            self.count += 1
+            if self.count > self.max_chars:
+                self.count -= 1
+                accepted, self.stopped = chunk[:i], 'overlong'
+                break
+            if self.count >= self.min_chars and ch in SENTENCE_ENDS:
+                self._pending_end = True
+        if accepted is None:
+            accepted = chunk
+        self.text += accepted
+        if self._pending_end and not self.stopped and not _quotes_open(self.text):
+            # 句末标点落在分块末尾且没有未闭合的引号：不再等下一块
+            self.stopped = 'early_stop'
+        return accepted
+
+    def finish(self):
+        """上游结束时返回已接受的文本"""
+        if self._pending_end and not self.stopped:
+            self.stopped = 'early_stop'
+        return self.text
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预生成日记池
+按缓存键为每种画像预先生成若干条日记，请求到来时直接取用；后台任务在空闲时补满
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+
+def seed_profiles(limit, bucket_size=10):
+    """
+    预置画像：把所有可能的答卷交给服务端计分，按 (原型, 分桶分数, 答题模式) 分组，
+    取覆盖答卷最多的 limit 个画像，生成与服务端计分结果一致的请求体（键与真实请求相同）
+    """
+    if limit <= 0:
+        return
+    import numpy as np
+
+    from shadow_scoring import LABELS, get_model, pattern_masks
+
+    model = get_model()
+    sizes = [len(q['options']) for q in model.questions]
+    codes = np.indices(sizes).reshape(len(sizes), -1).T
+    result = model.score(codes)
+    # 各答卷中 A/B/C/D 的出现次数（与 analyze_answer_patterns 一致）
+    distribution = np.zeros((len(codes), len(LABELS)), dtype=int)
+    for i, question in enumerate(model.questions):
+        for j, option in enumerate(question['options']):
+            if option['label'] in LABELS:
+                distribution[:, LABELS.index(option['label'])] += codes[:, i] == j
+    groups = np.column_stack([
+        result['primary'],
+        result['normalizedScores'] // max(1, int(bucket_size)),
+        pattern_masks(distribution),
+    ])
+    _, first, frequency = np.unique(groups, axis=0, return_index=True, return_counts=True)
+    for index in first[np.argsort(-frequency, kind='stable')][:limit]:
+        answers = {qid: model.questions[i]['options'][j]['label']
+                   for i, (qid, j) in enumerate(zip(model.question_ids, codes[index]))}
+        scored = model.calculate_result(answers)
+        archetype = scored['primaryArchetype']
+        yield {
+            'primaryArchetype': {'id': archetype['id'], 'nameCN': archetype['nameCN'], 'nameEN': archetype['nameEN']},
+            'normalizedScores': scored['normalizedScores'],
+            'shadowSyncRate': scored['shadowSyncRate'],
+            'answers': answers,
+        }
+
+
+class DiaryPool:
+    """
+    日记池：每个键是一条未被使用过的日记队列，取出即消耗
+
+    不配置 db_path 时队列保存在本进程内存中；配置后 SQLite 就是队列本身，不在内存中保留副本，
+    多个 worker 进程共用同一个库，take 用一条 DELETE ... RETURNING 原子地认领一行，同一条日记只会被取走一次。
+    事件循环中使用 atake / aadd / adeficits，把 SQLite 读写放到线程池。
+
+    Args:
+        target_depth: 每个键补充到的目标条数
+        max_profiles: 记录的补充目标画像数量上限（LRU淘汰，预置画像不淘汰）
+        db_path: SQLite 文件路径，离线预生成的日记可跨进程保存与共享
+    """
+
+    def __init__(self, target_depth=3, max_profiles=4096, db_path=None):
+        self.target_depth = target_depth
+        self.max_profiles = max_profiles
+        self._pools = {}  # key -> deque[diary]（仅内存模式）
+        self._depths = {}  # key -> 条数（SQLite 模式下最近一次查询的结果，供 stats 使用）
+        self._profiles = OrderedDict()  # key -> (请求体, 是否预置)
+        self._lock = threading.Lock()
+        self.served = 0
+        self.misses = 0
+        self.refilled = 0
+        self._db_path = db_path
+        self._db = None
+        self._pid = None
+        if db_path:
+            self._connection()
+
+    def _connection(self):
+        """当前进程的 SQLite 连接（首次使用或 fork 之后创建）；调用方持有 self._lock"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False, timeout=10)
+            # WAL：多个 worker 进程同时读写同一个池
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS diary_pool ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, diary TEXT NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS diary_pool_key ON diary_pool (key, id)')
+            self._db.commit()
+        return self._db
+
+    def reopen(self):
+        """fork 之后在子进程中重新连接 SQLite（连接不能跨进程共享）"""
+        if self._db_path:
+            with self._lock:
+                self._pid = None
+                self._connection()
+
+    def register(self, key, data, seeded=False):
+        """登记需要保持补满的画像"""
+        with self._lock:
+            if key in self._profiles:
+                self._profiles.move_to_end(key)
+                return
+            self._profiles[key] = (data, seeded)
+            if len(self._profiles) > self.max_profiles:
+                for old_key, (_, old_seeded) in self._profiles.items():
+                    if not old_seeded:
+                        del self._profiles[old_key]
+                        break
+
+    def take(self, key):
+        """取出一条日记，池为空时返回 None"""
+        with self._lock:
+            if self._db_path:
+                db = self._connection()
+                row = db.execute(
+                    'DELETE FROM diary_pool WHERE id = '
+                    '(SELECT id FROM diary_pool WHERE key = ? ORDER BY id LIMIT 1) RETURNING diary',
+                    (key,),
+                ).fetchone()
+                db.commit()
+                diary = row[0] if row is not None else None
+                if diary is not None and self._depths.get(key):
+                    self._depths[key] -= 1
+            else:
+                queue = self._pools.get(key)
+                diary = queue.popleft() if queue else None
+            if diary is None:
+                self.misses += 1
+            else:
+                self.served += 1
+            return diary
+
+    def add(self, key, diary):
+        """放入一条新生成的日记"""
+        with self._lock:
+            if self._db_path:
+                db = self._connection()
+                db.execute('INSERT INTO diary_pool (key, diary) VALUES (?, ?)', (key, diary))
+                db.commit()
+                self._depths[key] = self._depths.get(key, 0) + 1
+            else:
+                self._pools.setdefault(key, deque()).append(diary)
+            self.refilled += 1
+
+    def _current_depths(self, keys):
+        """各键当前的条数；SQLite 模式下查库（其他进程的取用与补充也计算在内）"""
+        if not self._db_path:
+            return {key: len(self._pools.get(key, ())) for key in keys}
+        rows = self._connection().execute('SELECT key, COUNT(*) FROM diary_pool GROUP BY key').fetchall()
+        self._depths = dict(rows)
+        return self._depths
+
+    def deficits(self):
+        """返回未补满的画像 [(key, 请求体, 缺少条数)]，最近被请求、最缺货的排在前面"""
+        with self._lock:
+            depths = self._current_depths(self._profiles)
+            result = []
+            for key, (data, _) in reversed(self._profiles.items()):
+                missing = self.target_depth - depths.get(key, 0)
+                if missing > 0:
+                    result.append((key, data, missing))
+            result.sort(key=lambda item: -item[2])
+            return result
+
+    async def atake(self, key):
+        """take 的异步版本：SQLite 模式下在线程池中执行"""
+        if self._db_path:
+            return await asyncio.to_thread(self.take, key)
+        return self.take(key)
+
+    async def aadd(self, key, diary):
+        """add 的异步版本：SQLite 模式下在线程池中执行"""
+        if self._db_path:
+            return await asyncio.to_thread(self.add, key, diary)
+        return self.add(key, diary)
+
+    async def adeficits(self):
+        """deficits 的异步版本：SQLite 模式下在线程池中执行"""
+        if self._db_path:
+            return await asyncio.to_thread(self.deficits)
+        return self.deficits()
+
+    def stats(self):
+        """日记池统计（SQLite 模式下 diaries 为最近一次查询/补充后的条数，不在此处查库）"""
+        with self._lock:
+            depths = self._depths if self._db_path else {key: len(q) for key, q in self._pools.items()}
+            return {
+                'profiles': len(self._profiles),
+                'diaries': sum(depths.values()),
+                'targetDepth': self.target_depth,
+                'served': self.served,
+                'misses': self.misses,
+                'refilled': self.refilled,
+                'persistent': self._db_path is not None,
+            }
+
+
+async def refill_worker(pool, generate, is_idle, interval=1.0, error_backoff=10.0):
+    """
+    后台补池任务
+
+    仅在 is_idle() 为真时生成，负载高时暂停补充，让请求把池子消耗下去
+    """
+    while True:
+        if not is_idle():
+            await asyncio.sleep(interval)
+            continue
+        deficits = await pool.adeficits()
+        if not deficits:
+            await asyncio.sleep(interval)
+            continue
+        key, data, _ = deficits[0]
+        try:
+            await pool.aadd(key, await generate(data))
+        except Exception as e:
+            print(f'Error refilling diary pool: {e}')
+            await asyncio.sleep(error_backoff)
+
+
+async def prefill(pool, generate, concurrency=8):
+    """离线预生成：把所有登记的画像一次性补满，返回生成条数"""
+    semaphore = asyncio.Semaphore(concurrency)
+    generated = 0
+
+    async def fill(key, data):
+        nonlocal generated
+        async with semaphore:
+            try:
+                await pool.aadd(key, await generate(data))
+                generated += 1
+            except Exception as e:
+                print(f'Error prefilling {key}: {e}')
+
+    jobs = [fill(key, data) for key, data, missing in await pool.adeficits() for _ in range(missing)]
+    await asyncio.gather(*jobs)
+    return generated
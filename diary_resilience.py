@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游尾延迟控制
+截止时间、对冲请求（hedging）与熔断器
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class UpstreamUnavailable(Exception):
+    """熔断器处于打开状态，直接降级而不调用上游"""
+
+
+class LatencyTracker:
+    """最近若干次成功调用的延迟（毫秒），用于计算对冲触发点"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, latency_ms):
+        self._samples.append(latency_ms)
+
+    def percentile(self, p, min_samples=20):
+        """返回第 p 百分位延迟，样本不足时返回 None"""
+        if len(self._samples) < min_samples:
+            return None
+        values = sorted(self._samples)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    在最近 window 次调用中，失败率或慢调用率超过阈值（且样本不少于 min_calls）即打开；
+    打开 cooldown 秒后进入半开状态，放行一次试探调用，成功则关闭，失败则重新打开；
+    试探调用超过 cooldown 秒仍未上报结果（例如客户端断开）时再放行一次。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window=50, min_calls=10, error_rate=0.5, slow_ms=15000, slow_rate=0.5, cooldown=30):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.short_circuited = 0
+        self._outcomes = deque(maxlen=window)  # (失败, 慢调用)
+        self._opened_at = 0.0
+        self._trial_inflight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否允许发起上游调用"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.OPEN and now - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._trial_inflight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and (
+                    not self._trial_inflight or now - self._trial_started >= self.cooldown):
+                self._trial_inflight = True
+                self._trial_started = now
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self, latency_ms):
+        with self._lock:
+            slow = latency_ms >= self.slow_ms
+            if self.state == self.HALF_OPEN:
+                if slow:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append((True, False))
+            self._evaluate()
+
+    def _evaluate(self):
+        total = len(self._outcomes)
+        if self.state != self.CLOSED or total < self.min_calls:
+            return
+        errors = sum(1 for failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        if errors / total >= self.error_rate or slow / total >= self.slow_rate:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._trial_inflight = False
+        self._outcomes.clear()
+
+    def stats(self):
+        """熔断器状态"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'recentCalls': len(self._outcomes),
+                'recentErrors': sum(1 for failed, _ in self._outcomes if failed),
+                'shortCircuited': self.short_circuited,
+            }
+
+
+async def hedged(factory, hedge_delay=None, max_attempts=2, on_hedge=None):
+    """
+    对冲调用：先发起一次，hedge_delay 秒内未返回则补发一次，取最先成功的结果
+
+    hedge_delay 为 None 时等价于直接 await factory()。所有调用都失败时抛出最后一个异常。
+    """
+    tasks = [asyncio.ensure_future(factory())]
+    last_error = None
+    try:
+        while True:
+            pending = [t for t in tasks if not t.done()]
+            can_hedge = hedge_delay is not None and len(tasks) < max_attempts
+            if not pending:
+                raise last_error
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=hedge_delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                tasks.append(asyncio.ensure_future(factory()))
+                if on_hedge is not None:
+                    on_hedge()
+                continue
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相同请求合并（single-flight）
+同一个键上并发的多个调用只发起一次上游生成，其余调用等待并共享结果
+"""
+
+import asyncio
+import hashlib
+
+
+def prompt_key(prompt):
+    """以提示词哈希作为合并键"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """
+    基于 asyncio 的请求合并
+
+    必须在同一个事件循环中使用。originated 统计真正发起的调用次数，
+    coalesced 统计搭便车、直接复用进行中结果的次数。
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.originated = 0
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        """执行 factory() 返回的协程；若同键调用正在进行则等待它的结果"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.originated += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield：某个等待者被取消时不影响其他等待者
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """合并统计"""
+        return {
+            'originated': self.originated,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+        }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时分析
+在子进程中以 python -X importtime 加载服务、完成初始化并处理第一个请求，
+输出从进程创建到首个请求的分阶段耗时，以及导入耗时排行
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+# 子进程：按生产 worker 的顺序启动，并用 Flask 测试客户端处理一次健康检查
+_CHILD = r'''
+import importlib.util, json, os, sys, time
+spawned = time.time()
+started = time.perf_counter()
+# 与直接运行脚本一致：脚本所在目录（而不是当前目录）在导入路径最前面
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[1])))
+spec = importlib.util.spec_from_file_location('shadow_diary_api', sys.argv[1])
+api = importlib.util.module_from_spec(spec)
+sys.modules['shadow_diary_api'] = api
+spec.loader.exec_module(api)
+imported = time.perf_counter()
+if sys.argv[2] == '1':
+    api.preload()
+preloaded = time.perf_counter()
+api.init_worker(started=started)
+ready = time.perf_counter()
+status = api.app.test_client().get('/api/health').status_code
+served = time.perf_counter()
+print(json.dumps({
+    'spawned': spawned, 'ready': time.time() - (served - ready), 'status': status,
+    'import': imported - started, 'preload': preloaded - imported,
+    'init': ready - preloaded, 'firstRequest': served - ready,
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块, 自身微秒, 累计微秒, 层级), ...]"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return modules
+
+
+def profile_startup(script_path, preload=True, top=15):
+    """
+    测量服务启动耗时，返回报告 dict
+
+    Args:
+        script_path: shadow-diary-api.py 的路径
+        preload: 是否与生产环境一样在初始化前执行 preload()
+        top: 导入排行显示的条数
+    """
+    spawn = time.time()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _CHILD, script_path, '1' if preload else '0'],
+        capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'启动失败:\n{proc.stderr[-2000:]}')
+    child = json.loads(proc.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(proc.stderr)
+
+    packages = {}
+    for name, self_us, _, _ in modules:
+        root = name.split('.')[0]
+        packages[root] = packages.get(root, 0) + self_us
+
+    ms = lambda seconds: round(seconds * 1000, 1)
+    return {
+        'preload': preload,
+        'phasesMs': {
+            'interpreter': ms(child['spawned'] - spawn),
+            'import': ms(child['import']),
+            'preload': ms(child['preload']),
+            'init': ms(child['init']),
+            'firstRequest': ms(child['firstRequest']),
+        },
+        'spawnToReadyMs': ms(child['ready'] - spawn),
+        'spawnToFirstRequestMs': ms(child['ready'] + child['firstRequest'] - spawn),
+        'healthStatus': child['status'],
+        'topImportsMs': [
+            {'module': name, 'cumulativeMs': round(cumulative / 1000, 1)}
+            for name, _, cumulative, _ in sorted(
+                (m for m in modules if m[3] == 0), key=lambda m: -m[2])[:top]
+        ],
+        'packagesMs': {
+            name: round(us / 1000, 1) for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]
+        },
+    }
+
+
+def print_startup_report(report):
+    print('=' * 60)
+    print(f"启动耗时分析 (preload={report['preload']})")
+    print('=' * 60)
+    for phase, value in report['phasesMs'].items():
+        print(f'  {phase:14s} {value:8.1f}ms')
+    print(f"  {'进程创建→就绪':10s} {report['spawnToReadyMs']:8.1f}ms")
+    print(f"  {'进程创建→首个请求':8s} {report['spawnToFirstRequestMs']:8.1f}ms  (健康检查 {report['healthStatus']})")
+
+    print('\n顶层导入（累计）:')
+    for item in report['topImportsMs']:
+        print(f"  {item['cumulativeMs']:8.1f}ms  {item['module']}")
+    print('\n按包汇总（自身耗时）:')
+    for name, value in report['packagesMs'].items():
+        print(f'  {value:8.1f}ms  {name}')
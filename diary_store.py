@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日记持久化存储
+按结果id保存已生成的日记（SQLite），重复查看与分享直接读库；写入先进内存缓冲，由后台线程批量提交
+"""
+
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def generation_version(*parts):
+    """生成版本：提示词模板、模型名等的摘要，任何一项变化后旧结果不再被复用"""
+    return hashlib.sha256('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:12]
+
+
+def result_id(data, version=''):
+    """
+    结果id：由原型、六维分数、同步率、答卷与生成版本（见 generation_version）决定，同一份测试结果
+    在同一版本下总是得到同一个id，重新加载页面时再次请求也能命中已保存的日记；提示词或模型变化后重新生成
+    """
+    archetype = data.get('primaryArchetype') or {}
+    identity = {
+        'archetype': archetype.get('id') or archetype.get('nameEN'),
+        'scores': data.get('normalizedScores'),
+        'syncRate': data.get('shadowSyncRate'),
+        'answers': {str(k): v for k, v in (data.get('answers') or {}).items()},
+        'version': version,
+    }
+    canonical = json.dumps(identity, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:20]
+
+
+def etag_for(record):
+    """强 ETag：内容不可变，id 加正文摘要即可"""
+    digest = hashlib.sha256(record['diary'].encode('utf-8')).hexdigest()[:12]
+    return f'"{record["id"]}-{digest}"'
+
+
+class DiaryStore:
+    """
+    日记存储
+
+    put 只写入内存缓冲，后台线程每 flush_interval 秒（或缓冲达到 batch_size 条）合并为一个事务提交，
+    提交时不持有缓冲锁；get 先查缓冲（含正在提交的一批）再用本线程的只读连接查库（WAL 下不等待写事务），
+    事件循环中用 aget 把查库放到线程池。SQLite 连接与写线程按进程惰性创建，fork 之后在子进程中自动重建。
+
+    Args:
+        db_path: SQLite 文件路径
+        flush_interval: 批量提交间隔（秒）
+        batch_size: 缓冲条数达到该值时立即提交
+    """
+
+    def __init__(self, db_path, flush_interval=0.5, batch_size=200):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self.flushes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}  # id -> record
+        self._flushing = {}  # 正在提交的一批，提交完成前仍可读到
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()  # 每个线程的只读连接
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._db = None
+        self._writer = None
+        atexit.register(self.flush)
+
+    def _connection(self):
+        """当前进程的连接（首次使用或 fork 之后创建）"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._writer = None
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            # WAL：多个 worker 进程可以同时读，写入不阻塞读取
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS diaries ('
+                'id TEXT PRIMARY KEY, diary TEXT NOT NULL, archetype TEXT, source TEXT, created_at REAL NOT NULL)'
+            )
+            self._db.commit()
+        return self._db
+
+    def _ensure_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, name='diary-store-writer', daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f'Error flushing diary store: {e}')
+
+    def put(self, record_id, diary, archetype=None, source=None):
+        """保存一条日记（只写内存缓冲，不等待落盘）；同一id已存在时保留先写入的内容"""
+        with self._lock:
+            self._connection()
+            self._ensure_writer()
+            if record_id in self._flushing:
+                return
+            self._pending.setdefault(record_id, {
+                'id': record_id,
+                'diary': diary,
+                'archetype': archetype,
+                'source': source,
+                'createdAt': time.time(),
+            })
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        """把缓冲中的日记在一个事务中写入（只在交换缓冲时持有锁，提交期间读写不受影响）"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                db = self._connection()
+            records = list(self._flushing.values())
+            try:
+                db.executemany(
+                    'INSERT OR IGNORE INTO diaries (id, diary, archetype, source, created_at) VALUES (?, ?, ?, ?, ?)',
+                    [(r['id'], r['diary'], r['archetype'], r['source'], r['createdAt']) for r in records],
+                )
+                db.commit()
+            except sqlite3.Error:
+                # 提交失败：放回缓冲等下次重试（先写入的内容优先）
+                with self._lock:
+                    self._pending = {**self._pending, **self._flushing}
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+                self.written += len(records)
+                self.flushes += 1
+            return len(records)
+
+    def _buffered(self, record_id):
+        with self._lock:
+            return self._pending.get(record_id) or self._flushing.get(record_id)
+
+    def _read(self, record_id):
+        """用本线程的只读连接查库"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            with self._lock:
+                self._connection()  # 建表
+            local.db = sqlite3.connect(self.db_path, timeout=10)
+            local.pid = os.getpid()
+        row = local.db.execute(
+            'SELECT id, diary, archetype, source, created_at FROM diaries WHERE id = ?', (record_id,)
+        ).fetchone()
+        return dict(zip(('id', 'diary', 'archetype', 'source', 'createdAt'), row)) if row is not None else None
+
+    def _count(self, record):
+        with self._lock:
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return record
+
+    def get(self, record_id):
+        """按id读取，返回 {'id', 'diary', 'archetype', 'source', 'createdAt'} 或 None"""
+        record = self._buffered(record_id)
+        if record is None:
+            record = self._read(record_id)
+        return self._count(record)
+
+    async def aget(self, record_id):
+        """get 的异步版本：缓冲未命中时在线程池中查库，不阻塞事件循环"""
+        record = self._buffered(record_id)
+        if record is None:
+            record = await asyncio.to_thread(self._read, record_id)
+        return self._count(record)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.db_path,
+                'pending': len(self._pending),
+                'written': self.written,
+                'flushes': self.flushes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
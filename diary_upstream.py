@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gemini 上游客户端
+进程内共享一个异步HTTP客户端（keep-alive连接池），直接调用代理的 REST 接口，
+与 google.generativeai 的 transport='rest' 发出的请求一致
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+import httpx
+
+from diary_cassette import CassetteTransport, cassette_from_env
+from diary_endpoints import EndpointPool, health_check_loop, parse_endpoints
+
+# 上游配置（环境变量可覆盖）
+API_KEY = os.environ.get('DIARY_API_KEY', 'sk-f3dd5285df3f42f9bdbdd0d436d11c4a')
+UPSTREAM_ENDPOINT = os.environ.get('DIARY_UPSTREAM_ENDPOINT', 'http://127.0.0.1:8045')
+# 多个代理端点（逗号分隔）时按延迟/负载选择，未设置时只用 UPSTREAM_ENDPOINT
+UPSTREAM_ENDPOINTS = parse_endpoints(os.environ.get('DIARY_UPSTREAM_ENDPOINTS'), UPSTREAM_ENDPOINT)
+ENDPOINT_STRATEGY = os.environ.get('DIARY_UPSTREAM_STRATEGY', 'least_latency')
+ENDPOINT_EJECT_AFTER = int(os.environ.get('DIARY_UPSTREAM_EJECT_AFTER', '3'))
+ENDPOINT_EJECT_SECONDS = float(os.environ.get('DIARY_UPSTREAM_EJECT_SECONDS', '30'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('DIARY_UPSTREAM_HEALTH_INTERVAL', '10'))
+MODEL_NAME = os.environ.get('DIARY_MODEL', 'gemini-3-flash')
+MAX_CONNECTIONS = int(os.environ.get('DIARY_UPSTREAM_MAX_CONNECTIONS', '256'))
+MAX_KEEPALIVE = int(os.environ.get('DIARY_UPSTREAM_MAX_KEEPALIVE', '64'))
+# 录制/回放卡带（DIARY_CASSETTE 为文件路径，DIARY_CASSETTE_MODE=record|replay，见 diary_cassette.py）
+CASSETTE = cassette_from_env('DIARY')
+
+
+class UpstreamError(Exception):
+    """上游返回非200或没有可用文本；status 为 HTTP 状态码（没有可用文本时为 None）"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def is_endpoint_failure(error):
+    """是否应归咎于端点（可换一个端点重试）：连接/超时错误、5xx、429；内容被拦截等不算"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, UpstreamError) and error.status is not None and (
+        error.status >= 500 or error.status == 429)
+
+
+def build_request_body(prompt):
+    """构建 generateContent 请求体"""
+    return {'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}
+
+
+def extract_text(payload):
+    """从 generateContent 响应中取出文本（等价于 SDK 的 response.text）"""
+    candidates = payload.get('candidates') or []
+    if not candidates:
+        raise UpstreamError(f'No candidates in response: {payload.get("promptFeedback")}')
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    text = ''.join(part.get('text', '') for part in parts)
+    if not text:
+        raise UpstreamError(f'Empty response, finishReason={candidates[0].get("finishReason")}')
+    return text
+
+
+class GeminiClient:
+    """
+    共享的异步 Gemini 客户端
+
+    httpx.AsyncClient 在首次使用时于当前事件循环中创建，之后所有请求复用同一个连接池（按主机分别保持连接）。
+    一个进程只应在一个事件循环里使用它（ASGI 模式用服务器的循环，Flask 模式用 run_sync 的后台循环）。
+    配置了多个端点时每次请求由端点池选择，端点故障时换一个端点重试（最多 max_attempts 个）。
+    """
+
+    def __init__(self, endpoints=UPSTREAM_ENDPOINTS, api_key=API_KEY, model=MODEL_NAME,
+                 max_connections=MAX_CONNECTIONS, max_keepalive=MAX_KEEPALIVE, max_attempts=2,
+                 cassette=CASSETTE):
+        self.endpoints = EndpointPool(
+            endpoints, strategy=ENDPOINT_STRATEGY,
+            eject_after=ENDPOINT_EJECT_AFTER, eject_seconds=ENDPOINT_EJECT_SECONDS,
+        )
+        self.max_attempts = max_attempts
+        self.api_key = api_key
+        self.model = model
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.cassette = cassette
+        self._ssl_context = None
+        self._client = None
+
+    def preload(self):
+        """提前完成与事件循环无关的准备（导入传输层、创建 SSL 上下文），可在 fork 之前调用"""
+        import httpcore  # noqa: F401  httpx 在首次创建客户端时才导入
+
+        if self._ssl_context is None:
+            self._ssl_context = httpx.create_ssl_context()
+
+    def _get_client(self):
+        if self._client is None:
+            verify = self._ssl_context or True
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+            )
+            transport = None
+            if self.cassette is not None:
+                # 指定 transport 后客户端不再使用自己的 verify/limits，交给录制时的真实 transport
+                inner = httpx.AsyncHTTPTransport(verify=verify, limits=limits) if self.cassette.mode == 'record' else None
+                transport = CassetteTransport(self.cassette, inner)
+            self._client = httpx.AsyncClient(
+                verify=verify,
+                headers={'x-goog-api-key': self.api_key},
+                limits=limits,
+                timeout=httpx.Timeout(120.0, connect=5.0),
+                transport=transport,
+            )
+        return self._client
+
+    @property
+    def ready(self):
+        """连接池是否已创建"""
+        return self._client is not None
+
+    async def start(self):
+        """在当前事件循环中创建连接池（服务启动时调用，之后的请求不再承担初始化开销）"""
+        self._get_client()
+
+    async def _generate_at(self, base_url, prompt):
+        response = await self._get_client().post(
+            f'{base_url}/v1beta/models/{self.model}:generateContent',
+            json=build_request_body(prompt),
+        )
+        if response.status_code != 200:
+            raise UpstreamError(f'Upstream HTTP {response.status_code}: {response.text[:200]}', response.status_code)
+        return extract_text(response.json())
+
+    async def generate_content(self, prompt):
+        """生成内容，返回完整文本"""
+        tried = []
+        attempts = min(self.max_attempts, len(self.endpoints))
+        for attempt in range(attempts):
+            endpoint = self.endpoints.choose(exclude=tried)
+            tried.append(endpoint.url)
+            try:
+                with self.endpoints.track(endpoint, is_endpoint_failure):
+                    return await self._generate_at(endpoint.url, prompt)
+            except Exception as e:
+                if attempt == attempts - 1 or not is_endpoint_failure(e):
+                    raise
+
+    async def stream_content(self, prompt):
+        """
+        流式生成（streamGenerateContent?alt=sse），逐块产出文本
+        与 generate_content 一样在端点故障时换端点重试，但只限于产出第一块之前（之后无法透明地重来）
+        """
+        tried = []
+        attempts = min(self.max_attempts, len(self.endpoints))
+        for attempt in range(attempts):
+            endpoint = self.endpoints.choose(exclude=tried)
+            tried.append(endpoint.url)
+            yielded = False
+            try:
+                with self.endpoints.track(endpoint, is_endpoint_failure):
+                    async with self._get_client().stream(
+                        'POST',
+                        f'{endpoint.url}/v1beta/models/{self.model}:streamGenerateContent',
+                        params={'alt': 'sse'},
+                        json=build_request_body(prompt),
+                    ) as response:
+                        if response.status_code != 200:
+                            body = await response.aread()
+                            raise UpstreamError(f'Upstream HTTP {response.status_code}: {body[:200]!r}',
+                                                response.status_code)
+                        async for line in response.aiter_lines():
+                            if not line.startswith('data:'):
+                                continue
+                            chunk = json.loads(line[5:])
+                            for candidate in chunk.get('candidates') or []:
+                                for part in (candidate.get('content') or {}).get('parts') or []:
+                                    if part.get('text'):
+                                        yielded = True
+                                        yield part['text']
+                return
+            except Exception as e:
+                if yielded or attempt == attempts - 1 or not is_endpoint_failure(e):
+                    raise
+
+    async def probe(self, base_url):
+        """轻量健康探测：列出模型，只要代理有响应（非5xx）即视为健康"""
+        response = await self._get_client().get(f'{base_url}/v1beta/models', timeout=3.0)
+        return response.status_code < 500
+
+    async def health_check_loop(self, interval=HEALTH_CHECK_INTERVAL):
+        """定期主动探测所有端点，被摘除的端点探测成功后提前恢复"""
+        await health_check_loop(self.endpoints, self.probe, interval)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# 进程内共享实例
+client = GeminiClient()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    """惰性启动供同步代码使用的后台事件循环"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='diary-upstream-loop', daemon=True).start()
+        return _loop
+
+
+def submit(coro):
+    """把协程提交到后台事件循环，不等待结果"""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop())
+
+
+def run_sync(coro):
+    """在后台事件循环中执行协程并阻塞等待结果（供 Flask 等同步视图使用）"""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+def iter_sync(agen):
+    """把异步生成器转换为同步迭代器（在后台事件循环中逐项拉取）"""
+    loop = _background_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地假上游
+模拟 Gemini REST 接口（generateContent / streamGenerateContent），可配置延迟分布、错误率与流式分片，
+用于压测 shadow-diary-api.py 而不消耗真实额度。
+
+用法: python3 fake_upstream.py --port 8045 --latency lognormal --latency-ms 1500 --error-rate 0.02
+然后以 DIARY_UPSTREAM_ENDPOINT=http://127.0.0.1:8045 启动 API
+"""
+
+import argparse
+import asyncio
+import json
+import random
+
+# 默认回复：约200字的第二人称独白，与真实日记长度相近
+DEFAULT_TEXT = (
+    '你以为你只是在冷静地观察，其实你早已在心里为每个人写好了判决书。'
+    '你说自己不在乎，可你记得每一次被忽视的瞬间，记得每一句没有被回应的话。'
+    '你把沉默当作盔甲，把疏离当作体面，仿佛只要不开口，就没有人能看穿你。'
+    '但你比谁都清楚，那份冷静并不是超然，而是害怕——害怕一旦表达，就会暴露你也渴望被理解。'
+    '你把每一次失望都归档成证据，却从不肯承认，最先被你放弃的人是你自己。'
+    '你审判别人，是因为你从未停止审判自己。'
+)
+
+
+class FakeUpstreamConfig:
+    """假上游的行为参数"""
+
+    def __init__(self, latency='fixed', latency_ms=800.0, jitter=0.5, error_rate=0.0, error_status=503,
+                 stream_chunks=8, text=DEFAULT_TEXT, seed=None):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_chunks = stream_chunks
+        self.text = text
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    def sample_latency(self):
+        """按配置的分布抽样一次延迟（秒）；latency_ms 为均值/中位数，jitter 为相对离散程度"""
+        mean = self.latency_ms
+        if self.latency == 'uniform':
+            value = self.random.uniform(mean * (1 - self.jitter), mean * (1 + self.jitter))
+        elif self.latency == 'normal':
+            value = self.random.gauss(mean, mean * self.jitter)
+        elif self.latency == 'lognormal':
+            # 中位数为 latency_ms 的长尾分布，最接近真实 LLM 接口
+            value = mean * self.random.lognormvariate(0, self.jitter)
+        else:
+            value = mean
+        return max(value, 0) / 1000
+
+    def should_fail(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+def create_app(config):
+    """构建 Starlette 应用（依赖 starlette，仅在使用时导入）"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    def candidate(text, finished=True):
+        item = {'content': {'role': 'model', 'parts': [{'text': text}]}}
+        if finished:
+            item['finishReason'] = 'STOP'
+        return {'candidates': [item]}
+
+    def error_response():
+        config.errors += 1
+        return JSONResponse(
+            {'error': {'code': config.error_status, 'message': 'fake upstream error', 'status': 'UNAVAILABLE'}},
+            status_code=config.error_status)
+
+    async def generate(request):
+        config.calls += 1
+        await request.body()
+        await asyncio.sleep(config.sample_latency())
+        if config.should_fail():
+            return error_response()
+        return JSONResponse(candidate(config.text))
+
+    async def stream_generate(request):
+        config.calls += 1
+        await request.body()
+        total = config.sample_latency()
+        if config.should_fail():
+            await asyncio.sleep(total)
+            return error_response()
+
+        text = config.text
+        chunks = max(1, config.stream_chunks)
+        size = max(1, -(-len(text) // chunks))
+
+        async def events():
+            # 首包约占总延迟的一半，其余时间均摊给后续分片
+            await asyncio.sleep(total / 2)
+            for i, start in enumerate(range(0, len(text), size)):
+                if i:
+                    await asyncio.sleep(total / 2 / chunks)
+                last = start + size >= len(text)
+                payload = json.dumps(candidate(text[start:start + size], last), ensure_ascii=False)
+                yield f'data: {payload}\r\n\r\n'
+
+        return StreamingResponse(events(), media_type='text/event-stream')
+
+    async def stats(request):
+        return JSONResponse({'calls': config.calls, 'errors': config.errors})
+
+    return Starlette(routes=[
+        Route('/v1beta/models/{model}:generateContent', generate, methods=['POST']),
+        Route('/v1beta/models/{model}:streamGenerateContent', stream_generate, methods=['POST']),
+        Route('/stats', stats),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地假上游（Gemini REST 接口）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8045)
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'normal', 'lognormal'], default='fixed',
+                        help='延迟分布')
+    parser.add_argument('--latency-ms', type=float, default=800.0, help='延迟均值/中位数（毫秒）')
+    parser.add_argument('--jitter', type=float, default=0.5, help='相对离散程度')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回错误的概率 (0~1)')
+    parser.add_argument('--error-status', type=int, default=503, help='错误时的HTTP状态码')
+    parser.add_argument('--stream-chunks', type=int, default=8, help='流式响应的分片数')
+    parser.add_argument('--text-file', help='用文件内容替换默认回复')
+    parser.add_argument('--seed', type=int, help='随机种子（复现延迟/错误序列）')
+    args = parser.parse_args()
+
+    text = DEFAULT_TEXT
+    if args.text_file:
+        with open(args.text_file, encoding='utf-8') as f:
+            text = f.read().strip()
+
+    config = FakeUpstreamConfig(
+        latency=args.latency, latency_ms=args.latency_ms, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=args.error_status,
+        stream_chunks=args.stream_chunks, text=text, seed=args.seed)
+
+    import uvicorn
+    print(f'🧪 假上游: http://{args.host}:{args.port}  延迟 {args.latency} {args.latency_ms}ms  错误率 {args.error_rate}')
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
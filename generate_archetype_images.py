@@ -3,20 +3,149 @@
 阴影原型图像生成器 - 霓虹线条艺术塔罗牌风格
 """
 
-import base64
+import argparse
+import binascii
+import hashlib
+import importlib
+import json
 import os
-import re
+import random
+import threading
 import time
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import openai
 from openai import OpenAI
 
-# API配置
-client = OpenAI(base_url="http://127.0.0.1:8045/v1", api_key="")
+from diary_cassette import CassetteTransport, cassette_from_env
+from diary_endpoints import EndpointPool, parse_endpoints, start_health_thread
+
+# API配置（多个代理端点逗号分隔，按延迟选择并在故障时切换）
+API_ENDPOINTS = parse_endpoints(os.environ.get("IMAGE_API_ENDPOINTS"), "http://127.0.0.1:8045/v1")
+HEALTH_CHECK_INTERVAL = float(os.environ.get("IMAGE_API_HEALTH_INTERVAL", "15"))
+# 录制/回放卡带（IMAGE_API_CASSETTE 为文件路径，IMAGE_API_CASSETTE_MODE=record|replay，见 diary_cassette.py）
+CASSETTE = cassette_from_env("IMAGE_API")
+
+
+def cassette_transport(http=None):
+    """配置了卡带时返回录制/回放 transport（模型调用与图像下载都经过它），否则返回 None"""
+    if CASSETTE is None:
+        return None
+    if http is None:
+        import httpx as http
+
+    return CassetteTransport(CASSETTE, http.HTTPTransport() if CASSETTE.mode == "record" else None, http=http)
+
+
+def create_client(url):
+    """端点的 OpenAI 客户端；重试由 generate_image 统一做（指数退避 + 自适应限流），关闭 SDK 自带的重试"""
+    if CASSETTE is None:
+        return OpenAI(base_url=url, api_key="", max_retries=0)
+    # SDK 所用的 httpx 模块（DefaultHttpxClient 的基类所在的包）
+    http = importlib.import_module(openai.DefaultHttpxClient.__base__.__module__.partition(".")[0])
+    return OpenAI(base_url=url, api_key="", max_retries=0,
+                  http_client=openai.DefaultHttpxClient(transport=cassette_transport(http)))
+
+
+clients = {url: create_client(url) for url in API_ENDPOINTS}
+endpoint_pool = EndpointPool(API_ENDPOINTS)
+
+
+def is_endpoint_failure(error):
+    """连接错误、超时、5xx与429归咎于端点；其余（如请求内容被拒）换端点也无济于事"""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code >= 500 or error.status_code == 429)
+
+
+def create_completion(max_attempts=2, **kwargs):
+    """chat.completions.create，经端点池选择端点，端点故障时换一个端点重试"""
+    tried = []
+    attempts = min(max_attempts, len(endpoint_pool))
+    for attempt in range(attempts):
+        endpoint = endpoint_pool.choose(exclude=tried)
+        tried.append(endpoint.url)
+        try:
+            with endpoint_pool.track(endpoint, is_endpoint_failure):
+                return clients[endpoint.url].chat.completions.create(**kwargs)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_endpoint_failure(e):
+                raise
+            print(f"⚠️  端点 {endpoint.url} 失败，切换端点重试: {str(e)}")
+
+
+def probe_endpoint(url):
+    """轻量健康探测：列出模型，非5xx即视为健康"""
+    return http_client().get(f"{url}/models", timeout=3.0).status_code < 500
+
+
+def retry_after_seconds(error):
+    """429/503 响应中的 Retry-After（秒），没有时返回 None"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    自适应并发限制（AIMD）
+
+    收到 429 时并发上限减半，并在 Retry-After 内暂停发起新请求；单次耗时超过最快一次的 slow_factor 倍时
+    上限降为 3/4；其余成功每次加 1/上限（大约每轮加一），不超过 max_limit。线程安全。
+    """
+
+    def __init__(self, max_limit, slow_factor=3.0):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.slow_factor = slow_factor
+        self.active = 0
+        self.throttled = 0
+        self.slowdowns = 0
+        self.fastest = None
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self.active < int(self.limit):
+                    self.active += 1
+                    return
+                self._cond.wait(wait if wait > 0 else None)
+
+    def release(self, latency=None, throttled=False, retry_after=None):
+        """latency 为成功调用的耗时（秒）；throttled 表示收到了 429"""
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+                self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 0))
+            elif latency is not None:
+                if self.fastest is not None and latency > self.fastest * self.slow_factor:
+                    self.slowdowns += 1
+                    self.limit = max(1.0, self.limit * 0.75)
+                else:
+                    self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self.fastest = latency if self.fastest is None else min(self.fastest, latency)
+            self._cond.notify_all()
 
 # 输出目录
 OUTPUT_DIR = "./src/assets/archetypes"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# 生成参数（参与输入哈希，修改后对应图像会被重新生成）
+MODEL = "gemini-3-pro-image"
+IMAGE_SIZE = "1280x720"
+
+# 生成清单：每个原型的输入哈希（完整提示词 + 模型 + 尺寸）与输出文件哈希，只重新生成有变化的原型
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "generation-manifest.json")
+
 # 统一视觉风格定义
 UNIFIED_STYLE = """
 Art Style: Glowing neon line art tarot card, digital occult wireframe illustration
@@ -192,41 +321,111 @@ NO TEXT - Pure symbolic line art on pure black background.
 ]
 
 
-def save_image_from_response(image_data, output_path):
-    """从API响应保存图像"""
+# 常见图像格式的文件头（代理返回的不一定是PNG）
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a")
+HEADER_BYTES = 12
+
+# 每次解码的 base64 字符数（4的倍数）与下载分块大小：单张图像的峰值内存与分辨率无关
+BASE64_CHUNK_CHARS = 1 << 20
+DOWNLOAD_CHUNK_BYTES = 1 << 16
+
+_http_client = None
+_http_lock = threading.Lock()
+
+
+def http_client():
+    """共享的 httpx.Client：各线程复用连接池，带超时"""
+    global _http_client
+    with _http_lock:
+        if _http_client is None:
+            import httpx
+
+            _http_client = httpx.Client(timeout=httpx.Timeout(60.0, connect=10.0), follow_redirects=True,
+                                        transport=cassette_transport())
+    return _http_client
+
+
+def is_image_header(header):
+    return header.startswith(IMAGE_SIGNATURES) or (header[:4] == b"RIFF" and header[8:12] == b"WEBP")
+
+
+def find_base64_span(text):
+    """定位 data URI（可在 markdown 图片链接中）里 base64 数据的 [start, end)，不复制字符串；找不到返回 None"""
+    uri = text.find("data:image/")
+    if uri < 0:
+        return None
+    marker = text.find(";base64,", uri)
+    if marker < 0:
+        return None
+    start = marker + len(";base64,")
+    # markdown 链接 ![image](data:...) 以右括号结束，裸 data URI 到字符串末尾
+    end = text.find(")", start)
+    if end < 0:
+        end = len(text)
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def iter_base64_chunks(text, start, end, chunk_chars=BASE64_CHUNK_CHARS):
+    """分块解码 text[start:end]，逐块产出字节；跳过换行等空白，不足4个字符的余量留到下一块"""
+    carry = ""
+    for pos in range(start, end, chunk_chars):
+        piece = carry + text[pos:min(pos + chunk_chars, end)]
+        if not piece.isalnum():
+            piece = "".join(piece.split())
+        usable = len(piece) - len(piece) % 4
+        carry = piece[usable:]
+        if usable:
+            yield binascii.a2b_base64(piece[:usable])
+    if carry:
+        yield binascii.a2b_base64(carry + "=" * (-len(carry) % 4))
+
+
+def write_image_atomic(chunks, output_path):
+    """
+    把字节块写入同目录的临时文件，文件头校验通过后原子替换 output_path；
+    文件头不是图像时提前放弃，不会覆盖已有的图像
+    """
+    tmp_path = output_path + ".part"
+    header = b""
     try:
-        # 提取markdown图片链接中的base64数据
-        if "![image](data:image/" in image_data:
-            match = re.search(r"data:image/[^;]+;base64,([^)]+)", image_data)
-            if match:
-                base64_data = match.group(1)
-                image_bytes = base64.b64decode(base64_data)
-                with open(output_path, "wb") as f:
-                    f.write(image_bytes)
-                return True
-        elif image_data.startswith("data:image"):
-            base64_data = re.sub("^data:image/.+;base64,", "", image_data)
-            image_bytes = base64.b64decode(base64_data)
-            with open(output_path, "wb") as f:
-                f.write(image_bytes)
-            return True
-        elif image_data.startswith("http"):
-            import requests
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                if len(header) < HEADER_BYTES:
+                    header += chunk[:HEADER_BYTES - len(header)]
+                    if len(header) == HEADER_BYTES and not is_image_header(header):
+                        break
+                f.write(chunk)
+        if not is_image_header(header):
+            print(f"保存失败: 数据不是可识别的图像（文件头 {header[:8]!r}）")
+            return False
+        os.replace(tmp_path, output_path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
-            img_response = requests.get(image_data)
-            with open(output_path, "wb") as f:
-                f.write(img_response.content)
-            return True
+def save_image_from_response(image_data, output_path):
+    """从API响应保存图像（markdown图片链接/data URI 中的base64，或图片URL）"""
+    try:
+        span = find_base64_span(image_data)
+        if span is not None:
+            return write_image_atomic(iter_base64_chunks(image_data, *span), output_path)
+        if image_data.startswith("http"):
+            with http_client().stream("GET", image_data.strip()) as response:
+                response.raise_for_status()
+                return write_image_atomic(response.iter_bytes(DOWNLOAD_CHUNK_BYTES), output_path)
         return False
     except Exception as e:
         print(f"保存失败: {str(e)}")
         return False
 
 
-def generate_image(archetype):
-    """生成单个原型图像"""
-
-    full_prompt = f"""
+def build_prompt(archetype):
+    """构建单个原型的图像提示词"""
+    return f"""
 {UNIFIED_STYLE}
 
 CHARACTER: {archetype["name_en"]} ({archetype["name_cn"]})
@@ -245,96 +444,351 @@ CRITICAL REQUIREMENTS:
 - Use specified color scheme for this character
 """
 
-    print(f"\n{'=' * 60}")
-    print(f"生成: {archetype['name_cn']} ({archetype['name_en']})")
-    print(f"配色: {archetype['color_scheme']}")
-    print(f"{'=' * 60}")
 
+def input_hash(archetype):
+    """原型的输入哈希：完整提示词、模型与尺寸"""
+    payload = json.dumps(
+        {"prompt": build_prompt(archetype), "model": MODEL, "size": IMAGE_SIZE},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def looks_like_image(path):
+    with open(path, "rb") as f:
+        return is_image_header(f.read(HEADER_BYTES))
+
+
+def load_manifest():
     try:
-        response = client.chat.completions.create(
-            model="gemini-3-pro-image",
-            extra_body={"size": "1280x720"},
-            messages=[{"role": "user", "content": full_prompt}],
-        )
-
-        image_data = response.choices[0].message.content
-        output_path = os.path.join(OUTPUT_DIR, f"{archetype['id']}.png")
-
-        if save_image_from_response(image_data, output_path):
-            file_size = os.path.getsize(output_path) / 1024
-            print(f"✅ 已保存: {output_path}")
-            print(f"   文件大小: {file_size:.1f} KB")
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest):
+    """先写临时文件再替换，中途中断也不会留下半个清单"""
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def manifest_entry(archetype, output_path, output_hash=None):
+    return {
+        "file": os.path.basename(output_path),
+        "inputHash": input_hash(archetype),
+        "outputHash": output_hash or file_hash(output_path),
+        "model": MODEL,
+        "size": IMAGE_SIZE,
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def image_status(archetype, manifest):
+    """
+    对比清单判断是否需要重新生成：missing（无图像）、corrupt（文件头不是图像或哈希与清单不符）、
+    changed（输入有变化或清单中没有记录）、ok
+    """
+    output_path = os.path.join(OUTPUT_DIR, f"{archetype['id']}.png")
+    if not os.path.exists(output_path):
+        return "missing"
+    entry = manifest.get(archetype["id"])
+    if not looks_like_image(output_path) or (entry and entry.get("outputHash") != file_hash(output_path)):
+        return "corrupt"
+    if not entry or entry.get("inputHash") != input_hash(archetype):
+        return "changed"
+    return "ok"
+
+
+def generate_image(archetype, limiter=None, max_retries=4, backoff=2.0, max_backoff=60.0, pipeline=None):
+    """
+    生成单个原型图像，返回保存路径（失败返回 None）
+
+    可重试的错误与响应中没有图像时按指数退避（带抖动）重试，429 时至少等待 Retry-After；
+    传入 limiter 时每次请求都经过自适应并发限制；传入 pipeline 时图像交给编码流水线，PNG 异步写出
+    """
+    tag = f"[{archetype['id']}]"
+    output_path = os.path.join(OUTPUT_DIR, f"{archetype['id']}.png")
+    full_prompt = build_prompt(archetype)
+
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        started = time.perf_counter()
+        error = None
+        try:
+            response = create_completion(
+                model=MODEL,
+                extra_body={"size": IMAGE_SIZE},
+                messages=[{"role": "user", "content": full_prompt}],
+            )
+            image_data = response.choices[0].message.content or ""
+        except Exception as e:
+            error = e
+        latency = time.perf_counter() - started
+        throttled = isinstance(error, openai.RateLimitError)
+        if limiter is not None:
+            limiter.release(
+                latency=None if error else latency,
+                throttled=throttled,
+                retry_after=retry_after_seconds(error) if throttled else None,
+            )
+
+        def report_saved(size, latency=latency):
+            print(f"✅ {tag} 已保存: {output_path} ({size / 1024:.1f} KB, {latency:.1f}s)")
+
+        saved_bytes = None
+        if error is None:
+            if pipeline is not None:
+                # PNG 母版异步写出，写完后才报告已保存
+                saved_bytes = pipeline.submit(archetype["id"], image_data, output_path, on_saved=report_saved)
+            elif save_image_from_response(image_data, output_path):
+                saved_bytes = os.path.getsize(output_path)
+                report_saved(saved_bytes)
+        if saved_bytes is not None:
             return output_path
+
+        reason = str(error) if error else "响应中没有图像"
+        # 请求本身有问题（4xx）重试也没用
+        if (error is not None and not is_endpoint_failure(error)) or attempt == max_retries:
+            print(f"❌ {tag} 生成失败: {reason}")
+            return None
+        delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if throttled:
+            delay = max(delay, retry_after_seconds(error) or 0)
+        print(f"⚠️  {tag} 第{attempt + 1}次失败（{reason}），{delay:.1f}秒后重试")
+        time.sleep(delay)
+
+
+class EncodePipeline:
+    """
+    生成-编码流水线（--encode）
+
+    模型返回的图像只在内存中解码一次，直接交给编码进程池生成全尺寸 WebP 与响应式变体（参数与
+    convert_to_webp.py 的默认值相同），与其余原型的生成并行；PNG 母版由写盘线程异步写出。
+    结束时更新 convert_to_webp.py 的转换清单与 srcset 清单，之后运行 convert_to_webp.py 会直接跳过这些图像。
+    """
+
+    def __init__(self, workers):
+        import convert_to_webp as webp
+
+        self.webp = webp
+        formats = webp.available_formats(webp.DEFAULT_FORMATS.split(","))
+        self.options = (webp.DEFAULT_QUALITY, webp.DEFAULT_METHOD, webp.parse_widths(webp.DEFAULT_WIDTHS),
+                        formats, webp.DEFAULT_AVIF_QUALITY, None)
+        self.settings = webp.encode_settings(*self.options)
+        # spawn：生成线程与连接池已在运行，fork 出的子进程可能继承被占用的锁
+        self.encoder = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="png-writer")
+        self.jobs = {}  # 原型id -> (PNG路径, 内容哈希, 写盘future, 编码future)
+        self._lock = threading.Lock()
+
+    def submit(self, stem, image_data, output_path, on_saved=None):
+        """
+        解码响应并提交写盘与编码，返回图像字节数；响应中没有图像或文件头不是图像时返回 None
+
+        base64 图像在内存中解码一次，PNG 母版由写盘线程异步写出；图片URL 边下载边写入母版（不整体缓冲），
+        编码进程再从母版读取。母版写完后调用 on_saved(字节数)
+        """
+        span = find_base64_span(image_data)
+        if span is not None:
+            data = b"".join(iter_base64_chunks(image_data, *span))
+            if not is_image_header(data[:HEADER_BYTES]):
+                return None
+            size, digest, source = len(data), hashlib.sha256(data).hexdigest(), data
+            write = self.writer.submit(write_image_atomic, [data], output_path)
+        elif image_data.startswith("http"):
+            if not save_image_from_response(image_data, output_path):
+                return None
+            size, digest, source = os.path.getsize(output_path), file_hash(output_path), output_path
+            write = Future()
+            write.set_result(True)
         else:
-            print(f"❌ 保存失败")
             return None
 
-    except Exception as e:
-        print(f"❌ 生成失败: {str(e)}")
-        return None
+        def written(future):
+            if on_saved is not None and future.exception() is None and future.result():
+                on_saved(size)
+
+        write.add_done_callback(written)
+        encode = self.encoder.submit(self.webp.convert_image_bytes, source, stem, *self.options)
+        with self._lock:
+            self.jobs[stem] = (output_path, digest, write, encode)
+        return size
+
+    def wait_master(self, stem):
+        """等待 PNG 母版写完，返回其内容哈希（写入失败时返回 None）"""
+        with self._lock:
+            _, digest, write, _ = self.jobs[stem]
+        return digest if write.result() else None
+
+    def finish(self):
+        """等待所有编码完成并更新转换清单，返回 [(原型id, webp_size, 变体列表, 错误信息), ...]"""
+        webp = self.webp
+        manifest = webp.load_manifest()
+        results = []
+        for stem, (output_path, digest, write, encode) in sorted(self.jobs.items()):
+            try:
+                if not write.result():
+                    raise RuntimeError("PNG母版写入失败")
+                webp_size, variants, chosen = encode.result()
+            except Exception as e:
+                results.append((stem, 0, [], str(e)))
+                continue
+            manifest[os.path.basename(output_path)] = webp.manifest_record(
+                output_path, digest, os.stat(output_path), self.settings, webp_size, variants, chosen)
+            results.append((stem, webp_size, variants, None))
+        webp.save_manifest(manifest)
+        webp.write_images_manifest(manifest)
+        self.encoder.shutdown()
+        self.writer.shutdown()
+        return results
+
+
+def check_connection():
+    """轻量连通性检查：探测各端点的模型列表（不再生成一张测试图像），有一个可用即可"""
+    healthy = []
+    for endpoint in endpoint_pool.endpoints:
+        try:
+            ok = probe_endpoint(endpoint.url)
+        except Exception as e:
+            print(f"   {endpoint.url}: {str(e)}")
+            ok = False
+        endpoint_pool.record_probe(endpoint, ok)
+        if ok:
+            healthy.append(endpoint.url)
+    return healthy
 
 
 def main():
     """主函数"""
-    import sys
+    parser = argparse.ArgumentParser(description="阴影原型图像生成器")
+    parser.add_argument("count", nargs="?", type=int, default=2, help="处理前 N 个原型（默认2个测试）")
+    parser.add_argument("--only", help="只处理指定的原型id（逗号分隔），忽略 count")
+    parser.add_argument("--force", action="store_true", help="忽略清单，重新生成选中的原型")
+    parser.add_argument("--encode", action="store_true",
+                        help="流水线模式：生成的图像在内存中直接编码为 WebP/AVIF 变体（无需再运行 convert_to_webp.py）")
+    parser.add_argument("--encode-workers", type=int, default=os.cpu_count() or 1, help="编码进程数")
+    parser.add_argument("--adopt", action="store_true",
+                        help="不调用模型，把选中原型的现有图像登记为当前提示词的产物（首次启用清单时使用）")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("IMAGE_WORKERS", "4")),
+                        help="最大并发数（按429与延迟自动调低）")
+    parser.add_argument("--retries", type=int, default=4, help="每个原型的最大重试次数")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+    if args.only:
+        ids = [i.strip() for i in args.only.split(",") if i.strip()]
+        unknown = sorted(set(ids) - {arch["id"] for arch in ARCHETYPES})
+        if unknown:
+            parser.error(f"未知的原型id: {', '.join(unknown)}")
+        selected = [arch for arch in ARCHETYPES if arch["id"] in ids]
+    else:
+        selected = ARCHETYPES[:max(1, min(args.count, len(ARCHETYPES)))]
+
+    manifest = load_manifest()
+    if args.adopt:
+        adopted = 0
+        for arch in selected:
+            output_path = os.path.join(OUTPUT_DIR, f"{arch['id']}.png")
+            if os.path.exists(output_path) and looks_like_image(output_path):
+                manifest[arch["id"]] = manifest_entry(arch, output_path)
+                adopted += 1
+        save_manifest(manifest)
+        print(f"已登记 {adopted}/{len(selected)} 个现有图像到 {MANIFEST_PATH}")
+        return
 
-    count = 2  # 默认生成2个测试
-    if len(sys.argv) > 1:
-        try:
-            count = int(sys.argv[1])
-            count = min(count, len(ARCHETYPES))
-        except:
-            pass
+    statuses = {arch["id"]: "forced" if args.force else image_status(arch, manifest) for arch in selected}
+    target_archetypes = [arch for arch in selected if statuses[arch["id"]] != "ok"]
+    count = len(target_archetypes)
 
     print("=" * 60)
     print("阴影原型图像生成器 - 霓虹线条艺术塔罗牌")
     print("=" * 60)
 
+    if len(API_ENDPOINTS) > 1:
+        print(f"API端点: {', '.join(API_ENDPOINTS)}")
+        start_health_thread(endpoint_pool, probe_endpoint, HEALTH_CHECK_INTERVAL)
+
+    if not target_archetypes:
+        print(f"\n选中的 {len(selected)} 个原型都没有变化，无需生成（--force 强制重新生成）")
+        return
+
     # 测试连接
     print("\n[1/3] 测试API连接...")
-    try:
-        test_response = client.chat.completions.create(
-            model="gemini-3-pro-image",
-            extra_body={"size": "1280x720"},
-            messages=[{"role": "user", "content": "Test: neon wireframe crystal"}],
-        )
-        print("✅ API连接成功")
-    except Exception as e:
-        print(f"❌ API连接失败: {str(e)}")
+    if not check_connection():
+        print("❌ API连接失败: 没有可用的端点")
         return
+    print("✅ API连接成功")
 
     # 显示生成计划
     print(f"\n[2/3] 生成计划:")
     print(f"风格: 霓虹线条艺术 + 性别中性 + 无文字嵌入")
-    print(f"本次生成: 前 {count} 个原型")
+    print(f"本次生成: {count}/{len(selected)} 个原型（其余没有变化，最多 {workers} 个并发）")
     print(f"输出目录: {OUTPUT_DIR}\n")
 
-    target_archetypes = ARCHETYPES[:count]
     for i, arch in enumerate(target_archetypes, 1):
-        print(f"  {i}. {arch['name_cn']:14s} - {arch['color_scheme']}")
+        print(f"  {i}. {arch['name_cn']:14s} - {arch['color_scheme']}  [{statuses[arch['id']]}]")
 
     print(f"\n{'=' * 60}")
 
     # 开始生成
     print(f"\n[3/3] 生成中...")
+    limiter = AdaptiveLimiter(workers)
+    pipeline = EncodePipeline(max(1, args.encode_workers)) if args.encode else None
+    started = time.perf_counter()
     success_count = 0
-
-    for i, archetype in enumerate(target_archetypes, 1):
-        print(f"\n进度: [{i}/{count}]")
-        result = generate_image(archetype)
-
-        if result:
-            success_count += 1
-
-        if i < count:
-            print("等待3秒...")
-            time.sleep(3)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(generate_image, arch, limiter, args.retries, pipeline=pipeline): arch
+            for arch in target_archetypes
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            output_path = future.result()
+            arch = futures[future]
+            output_hash = pipeline.wait_master(arch["id"]) if pipeline and output_path else None
+            if output_path and (pipeline is None or output_hash):
+                success_count += 1
+                # 每完成一个就写入清单，中途中断时已完成的不会重做
+                manifest[arch["id"]] = manifest_entry(arch, output_path, output_hash)
+                save_manifest(manifest)
+            print(f"进度: [{i}/{count}]")
+    generated = time.perf_counter() - started
+
+    if pipeline is not None:
+        print(f"\n等待编码完成...")
+        for stem, webp_size, variants, error in pipeline.finish():
+            if error:
+                print(f"❌ [{stem}] 编码失败: {error}")
+            else:
+                print(f"🖼  [{stem}] WebP {webp_size / 1024:.1f} KB + {len(variants)} 个变体")
+    elapsed = time.perf_counter() - started
 
     # 报告
     print(f"\n{'=' * 60}")
     print(f"生成完成!")
     print(f"{'=' * 60}")
     print(f"✅ 成功: {success_count}/{count}")
+    if pipeline is not None:
+        print(f"⏱  生成 {generated:.1f}s，编码收尾 {elapsed - generated:.1f}s")
+    print(f"⏱  总耗时: {elapsed:.1f}s（最终并发上限 {int(limiter.limit)}，429 {limiter.throttled} 次，"
+          f"变慢降速 {limiter.slowdowns} 次）")
+    if len(API_ENDPOINTS) > 1:
+        for stats in endpoint_pool.stats():
+            print(f"   {stats['url']}: 请求 {stats['requests']}  失败 {stats['failures']}  EWMA {stats['ewmaMs']}ms")
+    if CASSETTE is not None:
+        stats = CASSETTE.stats()
+        print(f"📼 卡带 {stats['path']} ({stats['mode']}): 录制 {stats['recorded']}，回放 {stats['replayed']}")
     print(f"\n输出目录: {OUTPUT_DIR}")
 
     if success_count == count:
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Shadow Diary API 的 gunicorn 配置（生产环境多进程）
+
+启动: gunicorn -c gunicorn.conf.py   或   python3 shadow-diary-api.py --production --workers 4
+环境变量:
+  DIARY_PORT            监听端口（默认 5001）
+  DIARY_WORKERS         worker 进程数（默认 CPU 核数）
+  DIARY_THREADS         每个 worker 的线程数（默认 16，视图大部分时间在等上游）
+  DIARY_PRELOAD         1 = fork 前在主进程加载应用与只读数据（默认），0 = 每个 worker 各自加载
+  DIARY_WORKER_TIMEOUT  worker 无响应多久后被重启（秒，默认 60）
+  DIARY_MAX_REQUESTS    处理多少请求后重启 worker（默认 0 不重启）
+
+/api/metrics 的指标按 worker 统计、不跨进程汇总，每个样本带 pid 标签（见 diary_metrics.py）
+"""
+
+import multiprocessing
+import os
+import time
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'wsgi:app'
+bind = f"0.0.0.0:{os.environ.get('DIARY_PORT', '5001')}"
+
+workers = int(os.environ.get('DIARY_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('DIARY_THREADS', '16'))
+timeout = int(os.environ.get('DIARY_WORKER_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('DIARY_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# 应用模块在导入时只加载数据、不创建线程和连接，fork 前预加载是安全的；
+# 上游连接池和后台事件循环在 post_worker_init 中为每个 worker 单独创建
+preload_app = os.environ.get('DIARY_PRELOAD', '1') == '1'
+
+
+def post_fork(server, worker):
+    worker.diary_forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    from wsgi import api
+
+    elapsed = api.init_worker(started=worker.diary_forked_at, forked=True)
+    worker.log.info('worker %s ready: cold start %.1fms (app load %sms, preload=%s)',
+                    worker.pid, elapsed * 1000,
+                    round(api.WORKER_STATE['appLoadSeconds'] * 1000, 1), preload_app)
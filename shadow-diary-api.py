@@ -2,12 +2,34 @@
 # -*- coding: utf-8 -*-
 """
 Shadow Diary API Service
-提供阴影日记生成的Flask服务端点
+提供阴影日记生成的服务端点（默认Flask，--asgi 为异步模式）
 """
 
-from flask import Flask, request, jsonify
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import google.generativeai as genai
+
+import diary_upstream as upstream
+from diary_admission import AdmissionController, ClientRateLimiter, Overloaded
+from diary_batch import iter_batch_items, iter_bytes, iter_file, run_batch
+from diary_cache import DiaryCache, make_cache_key
+from diary_length import LengthGuard, count_chars, fit_to_window
+from diary_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from diary_pool import DiaryPool, prefill, refill_worker, seed_profiles
+from diary_resilience import CircuitBreaker, LatencyTracker, UpstreamUnavailable, hedged
+from shadow_data import DEFAULT_FALLBACK_READING, DIMENSION_KEYS, describe_patterns, load_archetypes, load_fallback_readings
+from diary_singleflight import SingleFlight, prompt_key
+from diary_store import DiaryStore, etag_for, generation_version, result_id
 
 app = Flask(__name__)
 # 配置CORS，允许所有来源访问（开发环境）
@@ -18,16 +40,131 @@ CORS(app,
      methods=["GET", "POST", "OPTIONS"]
 )
 
-# 配置 Antigravity 代理
-genai.configure(
-    api_key="sk-f3dd5285df3f42f9bdbdd0d436d11c4a",
-    transport='rest',
-    client_options={'api_endpoint': 'http://127.0.0.1:8045'}
+# Antigravity 代理（http://127.0.0.1:8045）的连接配置见 diary_upstream.py
+
+# 日记缓存配置（环境变量可覆盖）
+CACHE_ENABLED = os.environ.get('DIARY_CACHE_ENABLED', '1') == '1'
+CACHE_BUCKET_SIZE = int(os.environ.get('DIARY_CACHE_BUCKET_SIZE', '10'))
+diary_cache = DiaryCache(
+    max_entries=int(os.environ.get('DIARY_CACHE_MAX_ENTRIES', '2048')),
+    ttl=int(os.environ.get('DIARY_CACHE_TTL', str(7 * 24 * 3600))),
+    variants=int(os.environ.get('DIARY_CACHE_VARIANTS', '3')),
+    db_path=os.environ.get('DIARY_CACHE_DB') or None,
+)
+
+# 日记持久化存储：按结果id保存，重复查看/分享走 GET /api/diary/<id>，不再调用上游
+STORE_ENABLED = os.environ.get('DIARY_STORE_ENABLED', '1') == '1'
+STORE_CACHE_CONTROL = os.environ.get('DIARY_STORE_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+diary_store = DiaryStore(
+    db_path=os.environ.get('DIARY_STORE_DB')
+    or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'diaries.db'),
+    flush_interval=float(os.environ.get('DIARY_STORE_FLUSH_INTERVAL', '0.5')),
 )
 
+# 批量生成的并发上限
+BATCH_MAX_CONCURRENCY = int(os.environ.get('DIARY_BATCH_MAX_CONCURRENCY', '16'))
+
+# 预生成日记池配置（默认关闭：后台补池会持续消耗上游额度）
+POOL_ENABLED = os.environ.get('DIARY_POOL_ENABLED', '0') == '1'
+POOL_IDLE_INFLIGHT = int(os.environ.get('DIARY_POOL_IDLE_INFLIGHT', '2'))
+# 预置画像数：按覆盖的答卷数从多到少取前 N 个真实可达的画像（0 表示不预置，只补充请求过的画像）
+POOL_SEED_PROFILES = int(os.environ.get('DIARY_POOL_SEED_PROFILES', '256'))
+diary_pool = DiaryPool(
+    target_depth=int(os.environ.get('DIARY_POOL_DEPTH', '3')),
+    db_path=os.environ.get('DIARY_POOL_DB') or None,
+)
+
+# 上游尾延迟控制：截止时间、可选的对冲请求、熔断降级到预制解读
+UPSTREAM_DEADLINE = float(os.environ.get('DIARY_UPSTREAM_DEADLINE', '20'))
+HEDGE_ENABLED = os.environ.get('DIARY_HEDGE_ENABLED', '0') == '1'
+HEDGE_PERCENTILE = float(os.environ.get('DIARY_HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.environ.get('DIARY_HEDGE_MIN_DELAY', '1.0'))
+breaker = CircuitBreaker(
+    error_rate=float(os.environ.get('DIARY_BREAKER_ERROR_RATE', '0.5')),
+    slow_ms=float(os.environ.get('DIARY_BREAKER_SLOW_MS', '15000')),
+    cooldown=float(os.environ.get('DIARY_BREAKER_COOLDOWN', '30')),
+)
+upstream_latency = LatencyTracker()
+RESILIENCE_STATS = {'hedged': 0, 'timeouts': 0}
+
+# 字数控制：提示词要求 180-220 字；流式生成在区间内写完一句即断开上游，
+# 不合格的结果截断或重新生成。HOLDOUT 比例的调用不提前停止，用来估算节省的字数与耗时
+LENGTH_MIN = int(os.environ.get('DIARY_LENGTH_MIN', '180'))
+LENGTH_MAX = int(os.environ.get('DIARY_LENGTH_MAX', '220'))
+EARLY_STOP_ENABLED = os.environ.get('DIARY_EARLY_STOP', '1') == '1'
+EARLY_STOP_HOLDOUT = float(os.environ.get('DIARY_EARLY_STOP_HOLDOUT', '0.05'))
+LENGTH_RETRIES = int(os.environ.get('DIARY_LENGTH_RETRIES', '1'))
+CHARS_PER_TOKEN = float(os.environ.get('DIARY_CHARS_PER_TOKEN', '1.0'))  # 中文输出的估算值
+NATURAL_LENGTH_CHARS = deque(maxlen=200)  # 完整生成（未提前停止）的字数
+LENGTH_STATS = {'savedTokens': 0, 'savedMs': 0.0}
+
+# 准入控制：上游并发上限 + 有界等待队列（每个进程各自限制），以及按客户端的令牌桶限流。
+# 令牌桶默认关闭：在反向代理后面需同时设置 DIARY_TRUST_PROXY=1，否则所有用户共用代理地址的一个桶
+TRUST_PROXY_HEADERS = os.environ.get('DIARY_TRUST_PROXY', '0') == '1'
+admission = AdmissionController(
+    max_concurrency=int(os.environ.get('DIARY_UPSTREAM_MAX_CONCURRENCY', '32')),
+    max_queue=int(os.environ.get('DIARY_UPSTREAM_QUEUE', '64')),
+    queue_timeout=float(os.environ.get('DIARY_UPSTREAM_QUEUE_TIMEOUT', '5')),
+    service_time=lambda: (upstream_latency.percentile(50, min_samples=1) or 0) / 1000,
+)
+rate_limiter = ClientRateLimiter(
+    rate=float(os.environ.get('DIARY_RATE_LIMIT', '0')),
+    burst=float(os.environ.get('DIARY_RATE_BURST', '5')),
+)
+
+# 正在处理的日记请求数（两种服务模式下都只在同一个事件循环中修改）
+inflight_requests = 0
+
+# 相同提示词的并发请求只调用一次上游
+upstream_flight = SingleFlight()
+
+# Prometheus 指标（/api/metrics）：按进程统计，多 worker 时每个样本带 pid 标签，汇总方式见 diary_metrics.py
+metrics = Registry(process_label='pid')
+STAGE_SECONDS = metrics.histogram(
+    'diary_stage_seconds', '日记请求各阶段耗时（秒）', ['stage'])
+REQUESTS_TOTAL = metrics.counter(
+    'diary_requests_total', '日记请求数', ['endpoint', 'outcome'])
+SOURCE_TOTAL = metrics.counter(
+    'diary_source_total', '成功返回的日记来源（pool / cache / upstream / fallback）', ['source'])
+DIARY_LENGTH = metrics.histogram(
+    'diary_length_chars', '返回的日记字数', buckets=(50, 100, 150, 180, 200, 220, 250, 300, 400, 600))
+STREAM_FIRST_CHAR_SECONDS = metrics.histogram(
+    'diary_stream_first_char_seconds', '流式生成首字时间（秒）')
+LENGTH_OUTCOME_TOTAL = metrics.counter(
+    'diary_length_outcome_total', '字数控制结果（early_stop / natural / trimmed / regenerated / out_of_spec）',
+    ['outcome'])
+EARLY_STOP_SAVED_TOKENS = metrics.histogram(
+    'diary_early_stop_saved_tokens', '提前停止每次节省的输出 token（估算）', buckets=(0, 10, 25, 50, 100, 200, 400, 800))
+EARLY_STOP_SAVED_SECONDS = metrics.histogram(
+    'diary_early_stop_saved_seconds', '提前停止每次节省的生成时间（秒，估算）',
+    buckets=(0, 0.1, 0.25, 0.5, 1, 2, 4, 8))
+WORKER_COLD_START_SECONDS = metrics.gauge(
+    'diary_worker_cold_start_seconds', '服务进程从启动（多进程模式下为 fork）到就绪的耗时（秒）')
+
+# 最近的延迟样本（毫秒）：流式首字时间 vs 完整响应时间
+RECENT_LATENCY = {
+    'stream_first_char_ms': deque(maxlen=1000),
+    'stream_total_ms': deque(maxlen=1000),
+    'full_response_ms': deque(maxlen=1000),
+}
+
+def latency_summary():
+    """延迟样本的 p50/p95 摘要"""
+    summary = {}
+    for name, samples in RECENT_LATENCY.items():
+        values = sorted(samples)
+        if not values:
+            summary[name] = None
+            continue
+        summary[name] = {
+            'count': len(values),
+            'p50': round(statistics.median(values), 1),
+            'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        }
+    return summary
+
 def analyze_answer_patterns(answers):
     """分析答题模式"""
-    patterns = []
     choices = list(answers.values())
     distribution = {
         'A': choices.count('A'),
@@ -36,17 +173,8 @@ def analyze_answer_patterns(answers):
         'D': choices.count('D'),
     }
 
-    # 识别极端选择倾向
-    if distribution['A'] > 12:
-        patterns.append("高频选择控制型/伪装型答案")
-    if distribution['B'] > 12:
-        patterns.append("倾向于对抗和报复策略")
-    if distribution['C'] > 12:
-        patterns.append("倾向于情感隔离和抽离策略")
-    if distribution['D'] > 12:
-        patterns.append("选择超然旁观的应对方式")
-
-    return '\n· '.join(patterns) if patterns else "答题模式较为均衡"
+    # 识别极端选择倾向（阈值与描述见 shadow_data.ANSWER_PATTERNS）
+    return describe_patterns(distribution)
 
 def build_prompt(data):
     """构建AI提示词"""
@@ -86,6 +214,617 @@ def build_prompt(data):
 
 请直接输出日记内容，不要任何前缀或解释。"""
 
+# 生成版本：用占位符渲染的提示词模板 + 模型 + 字数区间，修改任何一项后已保存的日记不再按id复用
+PROMPT_VERSION = generation_version(
+    build_prompt({
+        'primaryArchetype': {'nameCN': '{nameCN}', 'nameEN': '{nameEN}'},
+        'normalizedScores': {dim: '{' + dim + '}' for dim in DIMENSION_KEYS},
+        'shadowSyncRate': '{shadowSyncRate}',
+    }),
+    upstream.MODEL_NAME, LENGTH_MIN, LENGTH_MAX,
+)
+
+def apply_server_scoring(data):
+    """
+    答卷完整时在服务端重新计分（与 scoring.ts 的 calculateResult 一致），
+    覆盖客户端传来的 primaryArchetype / normalizedScores / shadowSyncRate
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('answers'), dict):
+        return data
+    # 计分引擎依赖 NumPy，首次使用时才导入（服务启动后通常已由 preload 在后台预热）
+    from shadow_scoring import get_model
+
+    scoring = get_model()
+    if not scoring.is_complete(data['answers']):
+        return data
+    result = scoring.calculate_result(data['answers'])
+    archetype = result['primaryArchetype']
+    return {
+        **data,
+        'primaryArchetype': {'id': archetype['id'], 'nameCN': archetype['nameCN'], 'nameEN': archetype['nameEN']},
+        'normalizedScores': result['normalizedScores'],
+        'shadowSyncRate': result['shadowSyncRate'],
+    }
+
+def validate_request(data):
+    """验证必需字段，返回错误信息或 None"""
+    if not isinstance(data, dict):
+        return 'Request body must be a JSON object'
+    required_fields = ['primaryArchetype', 'normalizedScores', 'shadowSyncRate']
+    for field in required_fields:
+        if field not in data:
+            return f'Missing required field: {field}'
+    return None
+
+def profile_key(data):
+    """请求画像键：原型 + 分桶分数 + 答题模式（缓存与日记池共用）"""
+    return make_cache_key(
+        data['primaryArchetype'],
+        data['normalizedScores'],
+        analyze_answer_patterns(data.get('answers', {})),
+        CACHE_BUCKET_SIZE
+    )
+
+def cache_key_for(data):
+    """计算请求的缓存键，缓存关闭时返回 None"""
+    return profile_key(data) if CACHE_ENABLED else None
+
+def diary_response(diary, source, record_id=None):
+    """成功响应体，source 为 store / pool / cache / upstream / fallback；record_id 为可用于分享的结果id"""
+    payload = {
+        'success': True,
+        'diary': diary,
+        'length': len(diary),
+        'cached': source != 'upstream',
+        'source': source
+    }
+    if record_id is not None:
+        payload['id'] = record_id
+    return payload
+
+def store_diary(record_id, data, diary, source):
+    """保存日记（批量异步落盘）并返回响应体；降级的预制解读不保存"""
+    if record_id is None:
+        return diary_response(diary, source)
+    archetype = data['primaryArchetype']
+    diary_store.put(record_id, diary, archetype=archetype.get('id') or archetype.get('nameEN'), source=source)
+    return diary_response(diary, source, record_id)
+
+def stored_diary(record_id, if_none_match=None):
+    """
+    GET /api/diary/<id>：返回 (响应体, 状态码, 响应头)
+    内容按id不可变，带强 ETag 与长期 Cache-Control，浏览器与 CDN/nginx 可直接缓存；ETag 匹配时返回 304
+    """
+    record = None
+    if STORE_ENABLED and len(record_id) == 20 and all(c in '0123456789abcdef' for c in record_id):
+        record = diary_store.get(record_id)
+    if record is None:
+        REQUESTS_TOTAL.inc(endpoint='diary', outcome='not_found')
+        return {'success': False, 'error': 'Diary not found', 'diary': ''}, 404, {'Cache-Control': 'no-store'}
+    etag = etag_for(record)
+    headers = {'ETag': etag, 'Cache-Control': STORE_CACHE_CONTROL}
+    REQUESTS_TOTAL.inc(endpoint='diary', outcome='success')
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return None, 304, headers
+    return {
+        'success': True,
+        'id': record['id'],
+        'diary': record['diary'],
+        'length': len(record['diary']),
+        'archetype': record['archetype'],
+        'createdAt': record['createdAt'],
+    }, 200, headers
+
+def degraded_response(data, retry_after):
+    """过载时的降级响应：预制解读 + 建议的重试间隔（由端点转为 Retry-After 头）"""
+    payload = diary_response(fallback_reading(data['primaryArchetype']), 'fallback')
+    payload.update(degraded=True, retryAfter=retry_after)
+    return payload
+
+def retry_after_headers(payload):
+    return {'Retry-After': str(payload['retryAfter'])} if 'retryAfter' in payload else {}
+
+def client_identity(remote_addr, forwarded_for=None):
+    """限流所用的客户端标识；仅在 DIARY_TRUST_PROXY=1（部署在反向代理之后）时采信 X-Forwarded-For"""
+    if TRUST_PROXY_HEADERS and forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return remote_addr or 'unknown'
+
+def check_rate_limit(client, endpoint):
+    """客户端超出速率时返回 (响应体, 429)，否则返回 None"""
+    wait = rate_limiter.acquire(client)
+    if wait is None:
+        return None
+    REQUESTS_TOTAL.inc(endpoint=endpoint, outcome='rate_limited')
+    return {'success': False, 'error': 'Rate limit exceeded', 'diary': '', 'retryAfter': wait}, 429
+
+def fallback_reading(archetype):
+    """与 src/data/fallbackReadings.ts 相同的预制解读"""
+    archetype_id = archetype.get('id')
+    if not archetype_id:
+        archetypes, _ = load_archetypes()
+        archetype_id = next((a['id'] for a in archetypes if a['nameEN'] == archetype.get('nameEN')), None)
+    return load_fallback_readings().get(archetype_id, DEFAULT_FALLBACK_READING)
+
+def hedge_delay():
+    """对冲触发点：最近成功调用延迟的第 N 百分位（秒），未启用或样本不足时返回 None"""
+    if not HEDGE_ENABLED:
+        return None
+    latency_ms = upstream_latency.percentile(HEDGE_PERCENTILE)
+    if latency_ms is None:
+        return None
+    return max(latency_ms / 1000, HEDGE_MIN_DELAY)
+
+def count_hedge():
+    RESILIENCE_STATS['hedged'] += 1
+
+def record_early_stop(guard, first_chunk_at, stopped_at):
+    """
+    估算提前停止节省的 token 与耗时：完整生成字数的中位数减去已生成字数，
+    按本次的逐字生成速度折算耗时；还没有完整生成样本时不估算
+    """
+    LENGTH_OUTCOME_TOTAL.inc(outcome='early_stop' if guard.stopped == 'early_stop' else 'overlong')
+    if len(NATURAL_LENGTH_CHARS) < 5 or not guard.count or first_chunk_at is None:
+        return
+    saved_chars = max(0, statistics.median(NATURAL_LENGTH_CHARS) - guard.count)
+    saved_ms = saved_chars * (stopped_at - first_chunk_at) * 1000 / guard.count
+    saved_tokens = saved_chars / CHARS_PER_TOKEN
+    LENGTH_STATS['savedTokens'] += round(saved_tokens)
+    LENGTH_STATS['savedMs'] += saved_ms
+    EARLY_STOP_SAVED_TOKENS.observe(saved_tokens)
+    EARLY_STOP_SAVED_SECONDS.observe(saved_ms / 1000)
+
+def record_natural_length(text):
+    LENGTH_OUTCOME_TOTAL.inc(outcome='natural')
+    NATURAL_LENGTH_CHARS.append(count_chars(text))
+
+async def stream_within_length(prompt):
+    """流式调用上游，字数区间内写完一句即关闭连接（上游随之停止生成），返回已接受的文本"""
+    holdout = random.random() < EARLY_STOP_HOLDOUT
+    guard = LengthGuard(LENGTH_MIN, LENGTH_MAX)
+    chunks = []
+    first_chunk_at = None
+    stream = upstream.client.stream_content(prompt)
+    try:
+        async for text in stream:
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            if holdout:
+                chunks.append(text)
+                continue
+            guard.feed(text)
+            if guard.stopped:
+                break
+    finally:
+        await stream.aclose()
+    if holdout:
+        diary = ''.join(chunks)
+        if not diary:
+            raise upstream.UpstreamError('Empty response')
+        record_natural_length(diary)
+        return diary
+    diary = guard.finish()
+    if not diary:
+        raise upstream.UpstreamError('Empty response')
+    if guard.stopped:
+        record_early_stop(guard, first_chunk_at, time.perf_counter())
+    else:
+        record_natural_length(diary)
+    return diary
+
+def generate_text(prompt):
+    return stream_within_length(prompt) if EARLY_STOP_ENABLED else upstream.client.generate_content(prompt)
+
+async def call_upstream(prompt):
+    """经过熔断器、准入控制、对冲与截止时间控制的上游调用"""
+    if not breaker.allow():
+        raise UpstreamUnavailable('Upstream circuit open')
+    try:
+        async with admission.slot():
+            started = time.perf_counter()
+            with STAGE_SECONDS.time(stage='upstream'):
+                diary = await asyncio.wait_for(
+                    hedged(lambda: generate_text(prompt), hedge_delay(), on_hedge=count_hedge),
+                    UPSTREAM_DEADLINE
+                )
+    except Overloaded:
+        # 没有真正调用上游，不计入熔断统计
+        raise
+    except asyncio.TimeoutError:
+        RESILIENCE_STATS['timeouts'] += 1
+        breaker.record_failure()
+        raise TimeoutError(f'Upstream deadline exceeded ({UPSTREAM_DEADLINE}s)')
+    except Exception:
+        breaker.record_failure()
+        raise
+    latency_ms = (time.perf_counter() - started) * 1000
+    breaker.record_success(latency_ms)
+    upstream_latency.record(latency_ms)
+    return diary
+
+async def generate_validated(prompt):
+    """调用上游并校验字数：超长的截到区间内最后一个完整句子，截不出合格结果的重新生成"""
+    for attempt in range(LENGTH_RETRIES + 1):
+        raw = await call_upstream(prompt)
+        diary, ok = fit_to_window(raw, LENGTH_MIN, LENGTH_MAX)
+        if ok:
+            if diary != raw.strip():
+                LENGTH_OUTCOME_TOTAL.inc(outcome='trimmed')
+            if attempt:
+                LENGTH_OUTCOME_TOTAL.inc(outcome='regenerated')
+            return diary
+    # 重试后仍不合格：返回最后一次的结果，好过让用户看不到日记
+    LENGTH_OUTCOME_TOTAL.inc(outcome='out_of_spec')
+    return diary
+
+async def generate_for_pool(data):
+    """为日记池生成一条日记（不经过缓存与请求合并）"""
+    return await generate_validated(build_prompt(data))
+
+def pool_is_idle():
+    return inflight_requests <= POOL_IDLE_INFLIGHT
+
+def seed_pool():
+    """登记覆盖答卷最多的 POOL_SEED_PROFILES 个画像"""
+    for data in seed_profiles(POOL_SEED_PROFILES, CACHE_BUCKET_SIZE):
+        diary_pool.register(profile_key(data), data, seeded=True)
+
+# 本进程的启动状态：上游连接池创建完成后才视为就绪（/api/health）
+MODULE_LOADED_AT = time.perf_counter()
+WORKER_STATE = {
+    'pid': os.getpid(), 'ready': False, 'warm': False, 'coldStartSeconds': None, 'appLoadSeconds': None,
+}
+
+def preload():
+    """
+    预加载只读数据与计分引擎；多进程模式下在 fork 之前于主进程执行，由各 worker 共享，
+    单进程模式下在就绪之后由后台线程执行（见 warm_in_background）
+    """
+    from shadow_scoring import get_model
+
+    load_archetypes()
+    load_fallback_readings()
+    get_model()
+    upstream.client.preload()
+    WORKER_STATE['warm'] = True
+
+def warm_in_background():
+    """尚未预加载时在后台线程中预热，不阻塞就绪"""
+    if not WORKER_STATE['warm']:
+        threading.Thread(target=preload, name='diary-warmup', daemon=True).start()
+
+def mark_ready(started):
+    """记录冷启动耗时并标记就绪"""
+    elapsed = time.perf_counter() - started
+    WORKER_STATE.update(pid=os.getpid(), ready=True, coldStartSeconds=round(elapsed, 4))
+    WORKER_COLD_START_SECONDS.set(round(elapsed, 4))
+    return elapsed
+
+def init_worker(started=None, forked=False):
+    """
+    初始化服务进程（Flask 模式）：在后台事件循环中创建上游连接池、启动日记池补充任务
+
+    started 为进程开始启动的时刻（time.perf_counter()），默认取模块加载时刻；
+    forked 表示在 fork 出的 worker 中调用，需要重新打开 SQLite 连接。返回冷启动耗时（秒）
+    """
+    if forked:
+        diary_cache.reopen()
+        diary_pool.reopen()
+    upstream.run_sync(upstream.client.start())
+    if POOL_ENABLED:
+        seed_pool()
+        upstream.submit(refill_worker(diary_pool, generate_for_pool, pool_is_idle))
+    if len(upstream.client.endpoints) > 1:
+        upstream.submit(upstream.client.health_check_loop())
+    warm_in_background()
+    return mark_ready(started if started is not None else MODULE_LOADED_AT)
+
+def record_success(payload):
+    """记录成功请求的指标，返回 (响应体, 200)"""
+    REQUESTS_TOTAL.inc(endpoint='json', outcome='success')
+    SOURCE_TOTAL.inc(source=payload['source'])
+    DIARY_LENGTH.observe(payload['length'])
+    return payload, 200
+
+async def produce_diary(data):
+    """
+    日记生成主流程：验证 → 已保存结果 → 日记池 → 缓存 → 调用上游
+
+    Flask 与 ASGI 两种服务模式共用，返回 (响应体, 状态码)
+    """
+    global inflight_requests
+    inflight_requests += 1
+    try:
+        with STAGE_SECONDS.time(stage='scoring'):
+            data = apply_server_scoring(data)
+        with STAGE_SECONDS.time(stage='validation'):
+            error = validate_request(data)
+        if error:
+            REQUESTS_TOTAL.inc(endpoint='json', outcome='invalid')
+            return {'error': error}, 400
+
+        # 同一份结果已生成过（刷新页面、重复查看）：直接返回保存的日记
+        record_id = result_id(data, PROMPT_VERSION) if STORE_ENABLED else None
+        if record_id is not None:
+            stored = await diary_store.aget(record_id)
+            if stored is not None:
+                return record_success(diary_response(stored['diary'], 'store', record_id))
+
+        # 优先取预生成的日记，未命中则登记该画像等待后台补池
+        if POOL_ENABLED:
+            key = profile_key(data)
+            diary = await diary_pool.atake(key)
+            diary_pool.register(key, data)
+            if diary is not None:
+                return record_success(store_diary(record_id, data, diary, 'pool'))
+
+        # 查询缓存，命中则跳过上游调用
+        cache_key = cache_key_for(data)
+        if cache_key is not None:
+            diary = diary_cache.get(cache_key)
+            if diary is not None:
+                return record_success(store_diary(record_id, data, diary, 'cache'))
+
+        # 构建提示词
+        with STAGE_SECONDS.time(stage='build_prompt'):
+            prompt = build_prompt(data)
+
+        # 调用AI生成（进程内共享的连接池客户端），相同提示词的并发请求合并为一次
+        started = time.perf_counter()
+        try:
+            diary = await upstream_flight.do(prompt_key(prompt), lambda: generate_validated(prompt))
+        except UpstreamUnavailable:
+            # 熔断中：直接返回预制解读，不再排队等待注定失败的调用
+            return record_success(diary_response(fallback_reading(data['primaryArchetype']), 'fallback'))
+        except Overloaded as e:
+            # 队列已满或排队超时：立即降级，延迟保持可预期
+            return record_success(degraded_response(data, e.retry_after))
+        RECENT_LATENCY['full_response_ms'].append((time.perf_counter() - started) * 1000)
+
+        # 重试后仍不合格的结果只返回给本次请求，不缓存、不保存
+        if not fit_to_window(diary, LENGTH_MIN, LENGTH_MAX)[1]:
+            return record_success(diary_response(diary, 'upstream'))
+        if cache_key is not None:
+            diary_cache.put(cache_key, diary)
+
+        return record_success(store_diary(record_id, data, diary, 'upstream'))
+
+    except Exception as e:
+        print(f'Error generating diary: {e}')
+        REQUESTS_TOTAL.inc(endpoint='json', outcome='error')
+        return {
+            'success': False,
+            'error': str(e),
+            'diary': ''  # 返回空字符串，前端可以优雅降级
+        }, 500
+    finally:
+        inflight_requests -= 1
+
+def sse_event(event, payload):
+    """格式化一条 Server-Sent Event"""
+    return f'event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+def fallback_events(data, **extra):
+    """以 SSE 形式返回预制解读（熔断或过载时）"""
+    diary = fallback_reading(data['primaryArchetype'])
+    REQUESTS_TOTAL.inc(endpoint='stream', outcome='success')
+    SOURCE_TOTAL.inc(source='fallback')
+    yield sse_event('chunk', {'text': diary})
+    yield sse_event('done', {'success': True, 'length': len(diary), 'cached': True, 'source': 'fallback', **extra})
+
+async def stream_diary_events(data):
+    """
+    流式日记生成，逐条产出 SSE 文本
+
+    chunk 事件携带增量文本；最后的 done 事件携带与 JSON 端点相同的
+    success/length，以及首字时间 firstCharMs 和总耗时 totalMs
+    """
+    with STAGE_SECONDS.time(stage='scoring'):
+        data = apply_server_scoring(data)
+    with STAGE_SECONDS.time(stage='validation'):
+        error = validate_request(data)
+    if error:
+        REQUESTS_TOTAL.inc(endpoint='stream', outcome='invalid')
+        yield sse_event('error', {'success': False, 'error': error, 'diary': ''})
+        return
+
+    started = time.perf_counter()
+    record_id = result_id(data, PROMPT_VERSION) if STORE_ENABLED else None
+    stored = await diary_store.aget(record_id) if record_id is not None else None
+    if stored is not None:
+        REQUESTS_TOTAL.inc(endpoint='stream', outcome='success')
+        SOURCE_TOTAL.inc(source='store')
+        yield sse_event('chunk', {'text': stored['diary']})
+        yield sse_event('done', {'success': True, 'length': len(stored['diary']), 'cached': True, 'id': record_id})
+        return
+
+    cache_key = cache_key_for(data)
+    if cache_key is not None:
+        diary = diary_cache.get(cache_key)
+        if diary is not None:
+            REQUESTS_TOTAL.inc(endpoint='stream', outcome='success')
+            SOURCE_TOTAL.inc(source='cache')
+            store_diary(record_id, data, diary, 'cache')
+            yield sse_event('chunk', {'text': diary})
+            yield sse_event('done', {'success': True, 'length': len(diary), 'cached': True, 'id': record_id})
+            return
+
+    if not breaker.allow():
+        for event in fallback_events(data):
+            yield event
+        return
+    try:
+        await admission.acquire()
+    except Overloaded as e:
+        for event in fallback_events(data, degraded=True, retryAfter=e.retry_after):
+            yield event
+        return
+
+    chunks = []
+    guard = LengthGuard(LENGTH_MIN, LENGTH_MAX) if EARLY_STOP_ENABLED else None
+    first_char_ms = None
+    stream = None
+    upstream_started = time.perf_counter()
+    try:
+        stream = upstream.client.stream_content(build_prompt(data))
+        while True:
+            # 截止时间作用于每个分块的等待，避免上游卡住时连接一直挂起
+            try:
+                text = await asyncio.wait_for(stream.__anext__(), UPSTREAM_DEADLINE)
+            except StopAsyncIteration:
+                break
+            if first_char_ms is None:
+                first_char_ms = (time.perf_counter() - started) * 1000
+                RECENT_LATENCY['stream_first_char_ms'].append(first_char_ms)
+                STREAM_FIRST_CHAR_SECONDS.observe(first_char_ms / 1000)
+            if guard is not None:
+                text = guard.feed(text)
+            if text:
+                chunks.append(text)
+                yield sse_event('chunk', {'text': text})
+            if guard is not None and guard.stopped:
+                # 字数已到区间内的句末：关闭上游连接，不再等待剩余输出
+                record_early_stop(guard, started + first_char_ms / 1000, time.perf_counter())
+                break
+    except Exception as e:
+        breaker.record_failure()
+        if isinstance(e, asyncio.TimeoutError):
+            RESILIENCE_STATS['timeouts'] += 1
+            e = TimeoutError(f'Upstream deadline exceeded ({UPSTREAM_DEADLINE}s)')
+        print(f'Error streaming diary: {e}')
+        REQUESTS_TOTAL.inc(endpoint='stream', outcome='error')
+        yield sse_event('error', {'success': False, 'error': str(e), 'diary': ''})
+        return
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        admission.release()
+        # 与 call_upstream 的 upstream 阶段口径一致：从获得准入到上游结束（含失败）
+        STAGE_SECONDS.observe(time.perf_counter() - upstream_started, stage='upstream')
+
+    total_ms = (time.perf_counter() - started) * 1000
+    raw = ''.join(chunks)
+    if not raw.strip():
+        # 与 stream_within_length 一致：空输出视为上游失败，不缓存、不保存
+        breaker.record_failure()
+        print('Error streaming diary: Empty response')
+        REQUESTS_TOTAL.inc(endpoint='stream', outcome='error')
+        yield sse_event('error', {'success': False, 'error': 'Empty response', 'diary': ''})
+        return
+    breaker.record_success(first_char_ms or total_ms)
+    RECENT_LATENCY['stream_total_ms'].append(total_ms)
+    if guard is not None and not guard.stopped:
+        record_natural_length(raw)
+    # 已发出的分块无法撤回：不合格时只截断保存的版本并在 done 中给出，不重新生成
+    diary, ok = fit_to_window(raw, LENGTH_MIN, LENGTH_MAX)
+    trimmed = diary != raw.strip()
+    if trimmed:
+        LENGTH_OUTCOME_TOTAL.inc(outcome='trimmed')
+    if not ok:
+        LENGTH_OUTCOME_TOTAL.inc(outcome='out_of_spec')
+    REQUESTS_TOTAL.inc(endpoint='stream', outcome='success')
+    SOURCE_TOTAL.inc(source='upstream')
+    DIARY_LENGTH.observe(len(diary))
+    # 只缓存、保存符合字数要求的日记；不合格的结果不生成可分享的id，下次请求重新生成
+    if not ok:
+        record_id = None
+    elif cache_key is not None:
+        diary_cache.put(cache_key, diary)
+    store_diary(record_id, data, diary, 'upstream')
+    yield sse_event('done', {
+        'success': True,
+        **({'outOfSpec': True} if not ok else {}),
+        'id': record_id,
+        'length': len(diary),
+        'cached': False,
+        **({'diary': diary, 'trimmed': True} if trimmed else {}),
+        'firstCharMs': round(first_char_ms, 1) if first_char_ms is not None else None,
+        'totalMs': round(total_ms, 1),
+    })
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',  # 关闭 nginx 缓冲，保证逐块送达
+}
+
+def batch_concurrency(value):
+    """解析 ?concurrency= 参数，限制在 [1, BATCH_MAX_CONCURRENCY]"""
+    try:
+        concurrency = int(value)
+    except (TypeError, ValueError):
+        concurrency = BATCH_MAX_CONCURRENCY
+    return max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+def health_payload():
+    """健康检查响应体"""
+    ready = WORKER_STATE['ready'] and upstream.client.ready
+    return {
+        'status': 'ok' if ready else 'starting',
+        'service': 'shadow-diary-api',
+        'worker': WORKER_STATE,
+        'cache': diary_cache.stats() if CACHE_ENABLED else None,
+        'latency': latency_summary(),
+        'coalescing': upstream_flight.stats(),
+        'pool': diary_pool.stats() if POOL_ENABLED else None,
+        'admission': {**admission.stats(), 'rateLimit': rate_limiter.stats()},
+        'store': diary_store.stats() if STORE_ENABLED else None,
+        'length': {
+            'window': [LENGTH_MIN, LENGTH_MAX],
+            'earlyStop': EARLY_STOP_ENABLED,
+            'naturalMedianChars': statistics.median(NATURAL_LENGTH_CHARS) if NATURAL_LENGTH_CHARS else None,
+            'savedTokens': LENGTH_STATS['savedTokens'],
+            'savedMs': round(LENGTH_STATS['savedMs'], 1),
+        },
+        'upstream': {
+            'breaker': breaker.stats(),
+            'deadlineSeconds': UPSTREAM_DEADLINE,
+            'hedgeDelaySeconds': hedge_delay(),
+            'endpoints': upstream.client.endpoints.stats(),
+            'cassette': upstream.client.cassette.stats() if upstream.client.cassette else None,
+            **RESILIENCE_STATS
+        }
+    }
+
+BREAKER_STATE_VALUES = {'closed': 0, 'half_open': 0.5, 'open': 1}
+
+def collect_service_metrics():
+    """导出进行中请求数以及合并、熔断、缓存、日记池的统计"""
+    flight = upstream_flight.stats()
+    yield 'diary_inflight_requests', 'gauge', '正在处理的日记请求数', None, inflight_requests
+    yield 'diary_upstream_calls_total', 'counter', '上游调用：实际发起 vs 被合并', {'kind': 'originated'}, flight['originated']
+    yield 'diary_upstream_calls_total', 'counter', '上游调用：实际发起 vs 被合并', {'kind': 'coalesced'}, flight['coalesced']
+    yield 'diary_upstream_hedged_total', 'counter', '触发的对冲请求数', None, RESILIENCE_STATS['hedged']
+    yield 'diary_upstream_timeouts_total', 'counter', '超过截止时间的上游调用数', None, RESILIENCE_STATS['timeouts']
+    breaker_stats = breaker.stats()
+    yield 'diary_breaker_state', 'gauge', '熔断器状态（0关闭 0.5半开 1打开）', None, BREAKER_STATE_VALUES[breaker_stats['state']]
+    yield 'diary_breaker_short_circuited_total', 'counter', '熔断降级的请求数', None, breaker_stats['shortCircuited']
+    admission_stats = admission.stats()
+    yield 'diary_upstream_active', 'gauge', '占用中的上游并发槽位', None, admission_stats['active']
+    yield 'diary_upstream_queued', 'gauge', '等待上游槽位的请求数', None, admission_stats['queued']
+    for reason, count in admission_stats['rejected'].items():
+        yield 'diary_admission_rejected_total', 'counter', '准入控制拒绝（降级）的请求数', {'reason': reason}, count
+    for endpoint in upstream.client.endpoints.stats():
+        labels = {'endpoint': endpoint['url']}
+        yield 'diary_endpoint_ewma_ms', 'gauge', '上游端点的EWMA延迟（毫秒）', labels, endpoint['ewmaMs'] or 0
+        yield 'diary_endpoint_inflight', 'gauge', '上游端点的进行中请求数', labels, endpoint['inflight']
+        yield 'diary_endpoint_ejected', 'gauge', '上游端点是否被摘除（1为摘除）', labels, int(endpoint['ejected'])
+        yield 'diary_endpoint_failures_total', 'counter', '上游端点的失败次数', labels, endpoint['failures']
+    yield 'diary_rate_limited_total', 'counter', '被客户端限流拒绝的请求数', None, rate_limiter.stats()['limited']
+    if STORE_ENABLED:
+        store_stats = diary_store.stats()
+        yield 'diary_store_pending', 'gauge', '等待批量写入的日记数', None, store_stats['pending']
+        yield 'diary_store_written_total', 'counter', '已写入存储的日记数', None, store_stats['written']
+        yield 'diary_store_flushes_total', 'counter', '批量写入次数', None, store_stats['flushes']
+    if CACHE_ENABLED:
+        yield 'diary_cache_entries', 'gauge', '缓存中的画像键数量', None, diary_cache.stats()['entries']
+    if POOL_ENABLED:
+        yield 'diary_pool_diaries', 'gauge', '日记池中可用的日记数', None, diary_pool.stats()['diaries']
+
+metrics.add_collector(collect_service_metrics)
+
+def flask_client_identity():
+    return client_identity(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
 @app.route('/api/generate-diary', methods=['POST', 'OPTIONS'])
 def generate_diary():
     """生成阴影日记的API端点"""
@@ -97,48 +836,275 @@ def generate_diary():
         response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
         return response
 
-    try:
-        data = request.json
-
-        # 验证必需字段
-        required_fields = ['primaryArchetype', 'normalizedScores', 'shadowSyncRate']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-
-        # 构建提示词
-        prompt = build_prompt(data)
+    limited = check_rate_limit(flask_client_identity(), 'json')
+    if limited:
+        payload, status = limited
+    else:
+        # 在共享的后台事件循环中执行，所有 Flask 线程复用同一个上游连接池
+        payload, status = upstream.run_sync(produce_diary(request.get_json(silent=True)))
+    with STAGE_SECONDS.time(stage='serialization'):
+        response = jsonify(payload)
+    return response, status, retry_after_headers(payload)
 
-        # 调用AI生成
-        model = genai.GenerativeModel('gemini-3-flash')
-        response = model.generate_content(prompt)
-        diary = response.text
+@app.route('/api/generate-diary/stream', methods=['POST'])
+def generate_diary_stream():
+    """流式生成阴影日记（Server-Sent Events）"""
+    limited = check_rate_limit(flask_client_identity(), 'stream')
+    if limited:
+        payload, status = limited
+        return jsonify(payload), status, retry_after_headers(payload)
+    events = upstream.iter_sync(stream_diary_events(request.get_json(silent=True)))
+    return Response(events, mimetype='text/event-stream', headers=SSE_HEADERS)
 
-        return jsonify({
-            'success': True,
-            'diary': diary,
-            'length': len(diary)
-        })
+@app.route('/api/generate-diaries', methods=['POST'])
+def generate_diaries():
+    """批量生成阴影日记：请求体为 JSON 数组或 JSONL，结果按完成顺序以 NDJSON 流式返回"""
+    limited = check_rate_limit(flask_client_identity(), 'batch')
+    if limited:
+        payload, status = limited
+        return jsonify(payload), status, retry_after_headers(payload)
+    # Flask 模式下请求体先整体读入（流式读取依赖 ASGI 模式），结果仍逐条返回
+    items = iter_batch_items(iter_bytes(request.get_data()))
+    lines = run_batch(items, produce_diary, batch_concurrency(request.args.get('concurrency')))
+    return Response(upstream.iter_sync(lines), mimetype='application/x-ndjson')
 
-    except Exception as e:
-        print(f'Error generating diary: {e}')
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'diary': ''  # 返回空字符串，前端可以优雅降级
-        }), 500
+@app.route('/api/diary/<record_id>', methods=['GET'])
+def get_diary(record_id):
+    """按结果id读取已保存的日记（可被浏览器/CDN缓存）"""
+    payload, status, headers = stored_diary(record_id, request.headers.get('If-None-Match'))
+    if payload is None:
+        return Response(status=status, headers=headers)
+    return jsonify(payload), status, headers
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康检查端点"""
-    return jsonify({'status': 'ok', 'service': 'shadow-diary-api'})
+    """健康检查端点（上游连接池就绪前返回503）"""
+    payload = health_payload()
+    return jsonify(payload), 200 if payload['status'] == 'ok' else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 指标端点"""
+    return Response(metrics.render(), mimetype=METRICS_CONTENT_TYPE)
+
+def create_asgi_app():
+    """
+    构建异步（ASGI）服务模式的应用
+
+    单进程即可同时挂起数百个进行中的上游请求。依赖 starlette 和 uvicorn：
+    pip install starlette uvicorn
+    """
+    from contextlib import asynccontextmanager
+    from urllib.parse import parse_qs
+
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    def asgi_client_identity(request):
+        return client_identity(request.client.host if request.client else None,
+                               request.headers.get('x-forwarded-for'))
+
+    def rate_limited_async(request, endpoint):
+        limited = check_rate_limit(asgi_client_identity(request), endpoint)
+        if limited:
+            payload, status = limited
+            return JSONResponse(payload, status_code=status, headers=retry_after_headers(payload))
+        return None
+
+    async def generate_diary_async(request):
+        limited = rate_limited_async(request, 'json')
+        if limited:
+            return limited
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        payload, status = await produce_diary(data)
+        with STAGE_SECONDS.time(stage='serialization'):
+            response = JSONResponse(payload, status_code=status, headers=retry_after_headers(payload))
+        return response
+
+    async def generate_diary_stream_async(request):
+        limited = rate_limited_async(request, 'stream')
+        if limited:
+            return limited
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        return StreamingResponse(
+            stream_diary_events(data),
+            media_type='text/event-stream',
+            headers=SSE_HEADERS,
+        )
+
+    class GenerateDiariesAsync:
+        """
+        批量端点直接实现为 ASGI 应用：边读请求体边写 NDJSON 结果
+
+        （StreamingResponse 会在响应期间监听断开消息，与读取请求体争抢 receive）
+        """
+
+        async def __call__(self, scope, receive, send):
+            async def body_chunks():
+                while True:
+                    message = await receive()
+                    if message['type'] != 'http.request':
+                        return
+                    yield message.get('body', b'')
+                    if not message.get('more_body'):
+                        return
+
+            headers = dict(scope.get('headers') or [])
+            client = client_identity((scope.get('client') or (None,))[0],
+                                     headers.get(b'x-forwarded-for', b'').decode('latin-1'))
+            limited = check_rate_limit(client, 'batch')
+            if limited:
+                payload, status = limited
+                await JSONResponse(payload, status_code=status, headers=retry_after_headers(payload))(
+                    scope, receive, send)
+                return
+
+            query = parse_qs(scope.get('query_string', b'').decode())
+            concurrency = batch_concurrency((query.get('concurrency') or [None])[0])
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'application/x-ndjson')],
+            })
+            async for line in run_batch(iter_batch_items(body_chunks()), produce_diary, concurrency):
+                await send({'type': 'http.response.body', 'body': line.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+    async def get_diary_async(request):
+        payload, status, headers = await asyncio.to_thread(
+            stored_diary, request.path_params['record_id'], request.headers.get('if-none-match'))
+        if payload is None:
+            return Response(status_code=status, headers=headers)
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    async def health_check_async(request):
+        payload = health_payload()
+        return JSONResponse(payload, status_code=200 if payload['status'] == 'ok' else 503)
+
+    async def metrics_async(request):
+        return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+    @asynccontextmanager
+    async def lifespan(asgi_app):
+        tasks = []
+        await upstream.client.start()
+        if POOL_ENABLED:
+            seed_pool()
+            tasks.append(asyncio.create_task(refill_worker(diary_pool, generate_for_pool, pool_is_idle)))
+        if len(upstream.client.endpoints) > 1:
+            tasks.append(asyncio.create_task(upstream.client.health_check_loop()))
+        warm_in_background()
+        mark_ready(MODULE_LOADED_AT)
+        yield
+        for task in tasks:
+            task.cancel()
+        await upstream.client.aclose()
+
+    return Starlette(
+        routes=[
+            Route('/api/generate-diary', generate_diary_async, methods=['POST']),
+            Route('/api/generate-diary/stream', generate_diary_stream_async, methods=['POST']),
+            Route('/api/generate-diaries', GenerateDiariesAsync(), methods=['POST']),
+            Route('/api/diary/{record_id}', get_diary_async, methods=['GET']),
+            Route('/api/health', health_check_async, methods=['GET']),
+            Route('/api/metrics', metrics_async, methods=['GET']),
+        ],
+        middleware=[
+            Middleware(
+                CORSMiddleware,
+                allow_origins=['*'],
+                allow_headers=['Content-Type'],
+                allow_methods=['GET', 'POST', 'OPTIONS'],
+            ),
+        ],
+        lifespan=lifespan,
+    )
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shadow Diary API Server')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--asgi', action='store_true', help='以异步模式运行（starlette + uvicorn）')
+    parser.add_argument('--production', action='store_true',
+                        help='生产模式：以 gunicorn 多进程运行（配置见 gunicorn.conf.py）')
+    parser.add_argument('--workers', type=int, help='生产模式的 worker 进程数（默认 DIARY_WORKERS 或 CPU 核数）')
+    parser.add_argument('--threads', type=int, help='生产模式每个 worker 的线程数（默认 DIARY_THREADS 或 16）')
+    parser.add_argument('--profile-startup', nargs='?', const='-', metavar='JSON',
+                        help='启动耗时分析：在子进程中启动服务并输出分阶段耗时与导入排行（可另存为 JSON）')
+    parser.add_argument('--no-preload', action='store_true', help='启动耗时分析时不预加载（对应 DIARY_PRELOAD=0）')
+    parser.add_argument('--prefill-pool', action='store_true',
+                        help='离线预生成：补满所有预置画像的日记池后退出（配合 DIARY_POOL_DB 使用）')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='批量生成：读取 JSON 数组或 JSONL 文件（- 为标准输入），NDJSON 结果写到标准输出')
+    parser.add_argument('--concurrency', type=int, default=8, help='批量生成的并发数')
+    args = parser.parse_args()
+
+    if args.batch:
+        async def batch_to_stdout():
+            f = sys.stdin.buffer if args.batch == '-' else open(args.batch, 'rb')
+            try:
+                async for line in run_batch(iter_batch_items(iter_file(f)), produce_diary, args.concurrency):
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+            finally:
+                f.close()
+
+        upstream.run_sync(batch_to_stdout())
+        raise SystemExit(0)
+
+    if args.profile_startup:
+        from diary_startup import print_startup_report, profile_startup
+
+        report = profile_startup(os.path.abspath(__file__), preload=not args.no_preload)
+        print_startup_report(report)
+        if args.profile_startup != '-':
+            with open(args.profile_startup, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        raise SystemExit(0)
+
+    if args.production:
+        os.environ['DIARY_PORT'] = str(args.port)
+        if args.workers:
+            os.environ['DIARY_WORKERS'] = str(args.workers)
+        if args.threads:
+            os.environ['DIARY_THREADS'] = str(args.threads)
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+        os.execvp('gunicorn', ['gunicorn', '-c', config])
+
+    if args.prefill_pool:
+        seed_pool()
+        print(f'预生成日记池: {len(diary_pool.deficits())} 个画像待补充，目标深度 {diary_pool.target_depth}')
+        generated = upstream.run_sync(prefill(diary_pool, generate_for_pool))
+        print(f'✅ 已生成 {generated} 条日记')
+        print(diary_pool.stats())
+        raise SystemExit(0)
+
     print('=' * 60)
     print('🌓 Shadow Diary API Server')
     print('=' * 60)
-    print('Server running on: http://localhost:5001')
-    print('API endpoint: POST http://localhost:5001/api/generate-diary')
-    print('Health check: GET http://localhost:5001/api/health')
+    print(f'Server running on: http://localhost:{args.port}')
+    print(f'Mode: {"ASGI (async)" if args.asgi else "Flask"}')
+    print(f'API endpoint: POST http://localhost:{args.port}/api/generate-diary')
+    print(f'Streaming:    POST http://localhost:{args.port}/api/generate-diary/stream')
+    print(f'Batch:        POST http://localhost:{args.port}/api/generate-diaries')
+    print(f'Saved diary:  GET http://localhost:{args.port}/api/diary/<id>')
+    print(f'Health check: GET http://localhost:{args.port}/api/health')
+    print(f'Metrics:      GET http://localhost:{args.port}/api/metrics')
     print('=' * 60)
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    if args.asgi:
+        import uvicorn
+
+        uvicorn.run(create_asgi_app(), host='0.0.0.0', port=args.port)
+    else:
+        # debug 重载器的父进程只负责监视文件，初始化只在实际服务的子进程中进行
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            init_worker()
+        app.run(host='0.0.0.0', port=args.port, debug=True)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+前端测试数据的 Python 读取器
+直接解析 src/data 下的 archetypes.ts / questions.ts / fallbackReadings.ts，保证服务端与前端只有一份数据源
+"""
+
+import os
+import re
+from functools import lru_cache
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'data')
+
+DIMENSION_KEYS = ['control', 'aggression', 'envy', 'masking', 'destruction', 'detachment']
+
+_STRING_FIELD = r"{name}:\s*['\"]([^'\"]*)['\"]"
+_OBJECT_FIELD = r'{name}:\s*\{{([^}}]*)\}}'
+
+
+def _read_source(filename):
+    """读取TS源文件并去掉整行注释（被注释掉的题目不参与计算）"""
+    with open(os.path.join(DATA_DIR, filename), encoding='utf-8') as f:
+        lines = f.readlines()
+    return ''.join(line for line in lines if not line.lstrip().startswith('//'))
+
+
+def _string_field(block, name):
+    match = re.search(_STRING_FIELD.format(name=name), block)
+    return match.group(1) if match else None
+
+
+def _number_map(block, name):
+    match = re.search(_OBJECT_FIELD.format(name=name), block)
+    if not match:
+        return {}
+    return {k: float(v) for k, v in re.findall(r'(\w+):\s*(-?\d+(?:\.\d+)?)', match.group(1))}
+
+
+def _parse_archetype(block):
+    scores = _number_map(block, 'radarScores')
+    return {
+        'id': _string_field(block, 'id'),
+        'nameCN': _string_field(block, 'nameCN'),
+        'nameEN': _string_field(block, 'nameEN'),
+        'primary': _string_field(block, 'primary'),
+        'secondary': _string_field(block, 'secondary'),
+        'radarScores': {dim: int(scores.get(dim, 0)) for dim in DIMENSION_KEYS},
+    }
+
+
+@lru_cache(maxsize=1)
+def load_archetypes():
+    """返回 (12个原型列表, 混沌原型)"""
+    source = _read_source('archetypes.ts')
+    body, chaos = source.split('export const CHAOS_ARCHETYPE', 1)
+    body = body.split('export const ARCHETYPES', 1)[1]
+    blocks = re.split(r"\n\s*\{\s*\n(?=\s*id:)", body)[1:]
+    return [_parse_archetype(block) for block in blocks], _parse_archetype(chaos)
+
+
+@lru_cache(maxsize=1)
+def load_questions():
+    """返回启用中的题目列表：[{'id': 1, 'options': [{'label': 'A', 'weights': {...}}, ...]}, ...]"""
+    source = _read_source('questions.ts').split('export const QUESTIONS', 1)[1]
+    questions = []
+    for block in re.split(r'\n\s*\{\s*\n(?=\s*id:\s*\d)', source)[1:]:
+        question_id = int(re.search(r'id:\s*(\d+)', block).group(1))
+        options = [
+            {'label': label, 'weights': {k: float(v) for k, v in re.findall(r'(\w+):\s*(-?\d+(?:\.\d+)?)', weights)}}
+            for label, weights in re.findall(r"label:\s*['\"](\w)['\"][\s\S]*?weights:\s*\{([^}]*)\}", block)
+        ]
+        questions.append({'id': question_id, 'options': options})
+    return questions
+
+
+# 答题模式：某个选项出现次数超过阈值时附加的描述（analyze_answer_patterns 与离线分析共用）
+ANSWER_PATTERNS = [
+    ('A', 12, '高频选择控制型/伪装型答案'),
+    ('B', 12, '倾向于对抗和报复策略'),
+    ('C', 12, '倾向于情感隔离和抽离策略'),
+    ('D', 12, '选择超然旁观的应对方式'),
+]
+BALANCED_PATTERN = '答题模式较为均衡'
+
+
+def describe_patterns(distribution):
+    """由 {'A': 次数, ...} 得到答题模式描述"""
+    patterns = [text for label, threshold, text in ANSWER_PATTERNS if distribution.get(label, 0) > threshold]
+    return '\n· '.join(patterns) if patterns else BALANCED_PATTERN
+
+
+DEFAULT_FALLBACK_READING = '系统正在分析你的阴影模式...请稍后刷新页面查看完整解读。'
+
+
+@lru_cache(maxsize=1)
+def load_fallback_readings():
+    """返回 src/data/fallbackReadings.ts 中按原型id索引的预制解读"""
+    source = _read_source('fallbackReadings.ts')
+    return dict(re.findall(r"'([\w-]+)':\s*`([^`]*)`", source))
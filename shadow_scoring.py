@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务端计分引擎
+与 src/utils/scoring.ts 的 calculateResult 保持一致：原始分 → 归一化 → 混沌/屏障判定 → 原型匹配 → 同步率。
+题目权重预先展开为 NumPy 矩阵，一份答卷和一百万份答卷都是一次向量化计算。
+"""
+
+import numpy as np
+
+from shadow_data import ANSWER_PATTERNS, DIMENSION_KEYS, describe_patterns, load_archetypes, load_questions
+
+LABELS = ['A', 'B', 'C', 'D']
+
+
+def pattern_masks(letter_counts):
+    """
+    向量化的答题模式：letter_counts 为 (N, 4) 的 A/B/C/D 次数，
+    返回 (N,) 位掩码，第 i 位表示 ANSWER_PATTERNS[i] 命中；describe_mask 可还原为描述
+    """
+    thresholds = np.array([threshold for _, threshold, _ in ANSWER_PATTERNS])
+    bits = 1 << np.arange(len(ANSWER_PATTERNS))
+    return ((np.asarray(letter_counts) > thresholds) * bits).sum(axis=1)
+
+
+def describe_mask(mask):
+    return describe_patterns({
+        label: threshold + 1 if mask & (1 << i) else 0
+        for i, (label, threshold, _) in enumerate(ANSWER_PATTERNS)
+    })
+
+
+class ScoringModel:
+    """预计算的计分矩阵"""
+
+    def __init__(self, questions=None, archetypes=None, chaos=None):
+        if questions is None:
+            questions = load_questions()
+        if archetypes is None or chaos is None:
+            archetypes, chaos = load_archetypes()
+        self.questions = questions
+        self.archetypes = archetypes
+        self.chaos = chaos
+        self.question_ids = [q['id'] for q in questions]
+        self.question_index = {q['id']: i for i, q in enumerate(questions)}
+        self.label_index = [{opt['label']: j for j, opt in enumerate(q['options'])} for q in questions]
+
+        # weights[q, option, dim]；多出的最后一个选项位留空，表示未作答
+        n_options = max(len(q['options']) for q in questions)
+        self.weights = np.zeros((len(questions), n_options + 1, len(DIMENSION_KEYS)))
+        for i, q in enumerate(questions):
+            for j, opt in enumerate(q['options']):
+                for dim, w in opt['weights'].items():
+                    self.weights[i, j, DIMENSION_KEYS.index(dim)] = w
+        self.missing = n_options
+
+        # letter_of[q, option]：选项下标对应的 A/B/C/D 下标，未作答（及 A~D 以外的选项）为 len(LABELS)
+        self.letter_of = np.full((len(questions), n_options + 1), len(LABELS), dtype=np.int64)
+        for i, q in enumerate(questions):
+            for j, opt in enumerate(q['options']):
+                if opt['label'] in LABELS:
+                    self.letter_of[i, j] = LABELS.index(opt['label'])
+
+        # 每题每维度取各选项最大权重（不低于0），再逐题累加
+        max_scores = np.maximum(self.weights.max(axis=1), 0).sum(axis=0)
+        self.max_scores = np.where(max_scores == 0, 1, max_scores)
+
+        dim = {key: i for i, key in enumerate(DIMENSION_KEYS)}
+        self.primary = np.array([dim[a['primary']] for a in archetypes])
+        self.secondary = np.array([dim[a['secondary']] for a in archetypes])
+
+    def encode(self, answer_sheets):
+        """把答卷列表 [{题号: 'A', ...}, ...] 编码为 (N, 题数) 的选项下标矩阵"""
+        codes = np.full((len(answer_sheets), len(self.questions)), self.missing, dtype=np.int8)
+        for n, answers in enumerate(answer_sheets):
+            for key, label in answers.items():
+                try:
+                    i = self.question_index[int(key)]
+                except (KeyError, ValueError):
+                    continue
+                # 非字符串的答案（如列表）不可哈希，按未作答处理
+                j = self.label_index[i].get(label) if isinstance(label, str) else None
+                if j is not None:
+                    codes[n, i] = j
+        return codes
+
+    def letter_counts(self, codes):
+        """由 encode 的选项下标矩阵得到 (N, 4) 的 A/B/C/D 次数（只统计已启用题目的有效答案）"""
+        codes = np.asarray(codes)
+        width = len(LABELS) + 1
+        letters = self.letter_of[np.arange(codes.shape[1]), codes]
+        flat = (np.arange(codes.shape[0])[:, None] * width + letters).ravel()
+        return np.bincount(flat, minlength=codes.shape[0] * width).reshape(-1, width)[:, :len(LABELS)]
+
+    def is_complete(self, answers):
+        """是否回答了全部启用的题目（对应 validateAnswers）"""
+        answered = {int(k) for k, v in answers.items() if str(k).isdigit() and isinstance(v, str) and v}
+        return all(qid in answered for qid in self.question_ids)
+
+    def score(self, codes):
+        """
+        向量化计分
+
+        Args:
+            codes: (N, 题数) 选项下标矩阵，见 encode
+
+        Returns:
+            dict，各字段均为长度 N 的数组：rawScores (N,6)、normalizedScores (N,6)、order (N,6) 维度降序、
+            isBarrier、isChaos、primary（原型下标，-1 表示混沌之影）、secondary（-1 表示无）、shadowSyncRate
+        """
+        codes = np.asarray(codes)
+        n = codes.shape[0]
+        raw = self.weights[np.arange(codes.shape[1]), codes].sum(axis=1)
+        # Math.round：.5 向上取整
+        normalized = np.floor(raw / self.max_scores * 100 + 0.5)
+
+        # 稳定排序，分数相同的维度保持定义顺序（与 Array.prototype.sort 一致）
+        order = np.argsort(-normalized, axis=1, kind='stable')
+        rows = np.arange(n)
+        top1, top2, bottom1 = order[:, 0], order[:, 1], order[:, -1]
+        top1_score = normalized[rows, top1]
+        top2_score = normalized[rows, top2]
+
+        is_barrier = (normalized < 30).all(axis=1)
+        is_chaos = normalized.std(axis=1) < 8
+
+        # 原型匹配：先找 (Top1, Top2) 精确匹配，否则在主维度为 Top1 的原型中取副维度得分最高者
+        secondary_scores = normalized[:, self.secondary]
+        primary_matches = self.primary[None, :] == top1[:, None]
+        exact = primary_matches & (self.secondary[None, :] == top2[:, None])
+        candidates = np.where(primary_matches, secondary_scores, -np.inf)
+        best = np.where(primary_matches.any(axis=1), candidates.argmax(axis=1), 0)
+        primary = np.where(exact.any(axis=1), exact.argmax(axis=1), best)
+
+        # 叠影态：Top1 与 Top2 相差不足5分时，取主维度为 Top2 的最佳原型
+        second_matches = self.primary[None, :] == top2[:, None]
+        second = np.where(second_matches, secondary_scores, -np.inf).argmax(axis=1)
+        secondary = np.where(
+            (np.abs(top1_score - top2_score) < 5) & second_matches.any(axis=1) & (second != primary),
+            second, -1)
+
+        primary = np.where(is_chaos, -1, primary)
+        secondary = np.where(is_chaos, -1, secondary)
+
+        # 同步率：Sigmoid((Max - 40) / 15) * (0.7 + 极化度 * 0.3) + 伪随机扰动
+        base = 100 / (1 + np.exp(-(top1_score - 40) / 15))
+        polarization = (top1_score - normalized[rows, bottom1]) / 100
+        noise = ((normalized.sum(axis=1) * 17) % 70) / 10 - 3.5
+        sync_rate = np.clip(base * (0.7 + polarization * 0.3) + noise, 47, 99.7)
+
+        return {
+            'rawScores': raw,
+            'normalizedScores': normalized,
+            'order': order,
+            'isBarrier': is_barrier,
+            'isChaos': is_chaos,
+            'primary': primary,
+            'secondary': secondary,
+            'shadowSyncRate': np.round(sync_rate, 1),
+        }
+
+    def archetype(self, index):
+        return self.chaos if index < 0 else self.archetypes[index]
+
+    def calculate_result(self, answers):
+        """单份答卷计分，返回与 ScoreResult 同结构的 dict"""
+        result = self.score(self.encode([answers]))
+        normalized = {dim: int(v) for dim, v in zip(DIMENSION_KEYS, result['normalizedScores'][0])}
+        secondary = int(result['secondary'][0])
+        return {
+            'rawScores': {dim: float(v) for dim, v in zip(DIMENSION_KEYS, result['rawScores'][0])},
+            'normalizedScores': normalized,
+            'dimensions': [
+                {'key': DIMENSION_KEYS[i], 'score': normalized[DIMENSION_KEYS[i]]}
+                for i in result['order'][0]
+            ],
+            'primaryArchetype': self.archetype(int(result['primary'][0])),
+            'secondaryArchetype': self.archetype(secondary) if secondary >= 0 else None,
+            'isChaos': bool(result['isChaos'][0]),
+            'isBarrier': bool(result['isBarrier'][0]),
+            'shadowSyncRate': float(result['shadowSyncRate'][0]),
+        }
+
+
+_model = None
+
+
+def get_model():
+    """进程内共享的计分模型（首次使用时构建）"""
+    global _model
+    if _model is None:
+        _model = ScoringModel()
+    return _model
+
+
+def calculate_result(answers):
+    return get_model().calculate_result(answers)
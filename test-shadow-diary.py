@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+
 import google.generativeai as genai
 
-# 配置 Antigravity 代理
+# 配置 Antigravity 代理（DIARY_UPSTREAM_ENDPOINT 可指向 diary_cassette.py 的卡带服务器，离线录制/回放）
 genai.configure(
     api_key="sk-f3dd5285df3f42f9bdbdd0d436d11c4a",
     transport='rest',
-    client_options={'api_endpoint': 'http://127.0.0.1:8045'}
+    client_options={'api_endpoint': os.environ.get('DIARY_UPSTREAM_ENDPOINT', 'http://127.0.0.1:8045')}
 )
 
 # 模拟用户数据：沉默的审判者
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生产环境 WSGI 入口
+shadow-diary-api.py 的文件名不能直接 import，这里按路径加载并导出 Flask 应用：
+gunicorn -c gunicorn.conf.py（或 python3 shadow-diary-api.py --production）
+"""
+
+import importlib.util
+import os
+import sys
+import time
+
+_started = time.perf_counter()
+_spec = importlib.util.spec_from_file_location(
+    'shadow_diary_api', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shadow-diary-api.py'))
+api = importlib.util.module_from_spec(_spec)
+sys.modules['shadow_diary_api'] = api
+_spec.loader.exec_module(api)
+api.preload()
+api.WORKER_STATE['appLoadSeconds'] = round(time.perf_counter() - _started, 4)
+
+app = api.app